@@ -6,6 +6,8 @@ import pathlib
 from time import time
 import pickle
 
+import numpy as np
+
 from transposeTraces import transposeTraces, getHeader, getNodeVectors
 from SelectionVectors import getSelectionVectors, getPlaintexts
 from RNR import RNR, getNRN, reduceVectors
@@ -31,9 +33,9 @@ def CPF_RNR(pathToTraces, pathToFullFRNR, E, f=30, t=-1, NRNonly=1, filtBy=0, be
 
     ##GETTING THE NODE VECTORS
     if NRNonly:
-        (NODEVECTORS, nodesToGoThrough, begining, ending) = getNodeVectors(pathToTraces, requiredT, begining=begining, ending=ending, NonRedundantNodes=NonRedundantNodes, silent=0)
+        (NODEVECTORS, nodesToGoThrough, begining, ending) = getNodeVectors(pathToTraces, requiredT, begining=begining, ending=ending, NonRedundantNodes=NonRedundantNodes, silent=0, mode='window', window=2*E)
     else:
-        (NODEVECTORS, nodesToGoThrough, begining, ending) = getNodeVectors(pathToTraces, requiredT, begining=begining, ending=ending, NonRedundantNodes=None, silent=0)
+        (NODEVECTORS, nodesToGoThrough, begining, ending) = getNodeVectors(pathToTraces, requiredT, begining=begining, ending=ending, NonRedundantNodes=None, silent=0, mode='window', window=2*E)
     numOfNodesVectors=len(nodesToGoThrough)
 
 
@@ -42,14 +44,9 @@ def CPF_RNR(pathToTraces, pathToFullFRNR, E, f=30, t=-1, NRNonly=1, filtBy=0, be
     SUMtime=0
     numberOfTimes=0
     nOfSkips=0
-    ONES = vector(GF(2), [1]*len(NODEVECTORS[0]))
 
     redundants = []
     try:
-        if not NRNonly:
-            filtPosInNRNlist=0
-            while NonRedundantNodes[filtPosInNRNlist]<begining:
-                filtPosInNRNlist+=1
         filtPos=0
         while filtPos<numOfNodesVectors:
             t1=time()
@@ -59,27 +56,16 @@ def CPF_RNR(pathToTraces, pathToFullFRNR, E, f=30, t=-1, NRNonly=1, filtBy=0, be
                 inds = list(range(max(0,filtPos-E), min(numOfNodesVectors-1,filtPos+E)))
                 if filtPos in inds:
                     inds.remove(filtPos)
-                matrixArray=NODEVECTORS[inds]
-                Window=Matrix(GF(2), matrixArray).transpose()
             else:
-                while NonRedundantNodes[filtPosInNRNlist]<filtPos+begining:
-                    filtPosInNRNlist+=1
+                filtPosInNRNlist=int(np.searchsorted(NonRedundantNodes, filtPos+begining))
                 #Get the window
-                inds=[]
-                for posInNRNlist in NonRedundantNodes[max(0,filtPosInNRNlist-E) : min(len(NonRedundantNodes)-1,filtPosInNRNlist+E)]:
-                    inds.append(min(numOfNodesVectors-1,max(0,(posInNRNlist-begining))))
+                inds=np.clip(NonRedundantNodes[max(0,filtPosInNRNlist-E) : min(len(NonRedundantNodes)-1,filtPosInNRNlist+E)]-begining, 0, numOfNodesVectors-1).tolist()
                 if filtPos in inds:
                     inds.remove(filtPos)
-                matrixArray=NODEVECTORS[inds]
-                Window=Matrix(GF(2), matrixArray).transpose()
 
 
             #Flitering
-            filtVector=NODEVECTORS[filtPos,:2*W+f+t][0]
-            if filtBy == 1:
-                filtColIdx=filtVector.support()[:2*W+f]
-            else:
-                filtColIdx=(ONES-filtVector).support()[:2*W+f]
+            filtColIdx=NODEVECTORS.support(filtPos, filtBy)[:2*W+f].tolist()
 
             if FullFRNR and FullFRNR[-1][0] == filtPos:
                 _, FullRedundant = FullFRNR.pop()
@@ -88,8 +74,9 @@ def CPF_RNR(pathToTraces, pathToFullFRNR, E, f=30, t=-1, NRNonly=1, filtBy=0, be
                 print(f"Skipping full-F-redundant nodes: {orig_len} -> {len(filtColIdx)} ({len(FullRedundant)})")
 
             if len(filtColIdx) >= 2*W+f:
-                #Get only non redundant nodes vector and filtered traces of the window:
-                WindowFilt = Window[filtColIdx].transpose()
+                #Get only non redundant nodes vector and filtered traces of the window
+                #(nodes x traces):
+                WindowFilt = NODEVECTORS.window(inds, filtColIdx).toSage()
 
                 linIndRows, _ = reduceVectors(WindowFilt, with_kernel=False)
                 if len(linIndRows) < WindowFilt.nrows():
@@ -104,6 +91,7 @@ def CPF_RNR(pathToTraces, pathToFullFRNR, E, f=30, t=-1, NRNonly=1, filtBy=0, be
                         redIndexes.append(i)
                     assert not (set(redIndexes) & set(linIndRows))
 
+                    Window=Matrix(GF(2), NODEVECTORS[inds]).transpose()
                     print("filtPos", filtPos, ":", Window.nrows(), Window.ncols(), "->", WindowFilt.nrows(), WindowFilt.ncols(), "rank", Window.rank(), "->", WindowFilt.rank(), ":", len(redIndexes), "relations")
                     redundants.append([filtPos, redIndexes])
                     print("redundant:", filtPos, ":", redIndexes)
@@ -77,7 +77,7 @@ def ExactMatching1(pathToTraces, t=-1, window=1, begining=0, ending=0, record=1,
     else:
         t = min(T, max(128, t))
 
-    NODEVECTORS, *_ = getNodeVectors(pathToTraces, t, begining=begining, ending=ending, NonRedundantNodes=None, silent=0, mode='mat')
+    NODEVECTORS, *_ = getNodeVectors(pathToTraces, t, begining=begining, ending=ending, NonRedundantNodes=None, silent=0, mode='packed')
     PLAINTEXTS = getPlaintexts(pathToTraces)
 
     #DEDUCING THE SELECTION VECTORS
@@ -98,21 +98,18 @@ def ExactMatching1(pathToTraces, t=-1, window=1, begining=0, ending=0, record=1,
     print("using bytes:", bytePositions)
     print("using masks:", masks)
 
-    SELECTIONVECTORS, INFO = getSelectionVectors(PLAINTEXTS, t, mode='mat', bytePositions=bytePositions, masks=masks)
+    SELECTIONVECTORS, INFO = getSelectionVectors(PLAINTEXTS, t, mode='packed', bytePositions=bytePositions, masks=masks, pathToTraces=pathToTraces)
     print("selection vectors:", len(SELECTIONVECTORS))
     print("     node vectors:", len(NODEVECTORS))
-    print("           traces:", NODEVECTORS[0].nrows())
+    print("           traces:", NODEVECTORS.ncols)
 
-    for selVec in SELECTIONVECTORS:
-        selVec.set_immutable()
-    lookup = dict(zip(SELECTIONVECTORS, INFO))
+    lookup = {SELECTIONVECTORS.rowKey(i): info for i, info in enumerate(INFO)}
 
     print("start loop")
     assert window == 1
     #if window == 1:
-    for pos, nodeVec in tqdm(enumerate(NODEVECTORS)):
-        nodeVec.set_immutable()
-        info = lookup.get(nodeVec)
+    for pos in tqdm(range(len(NODEVECTORS))):
+        info = lookup.get(NODEVECTORS.rowKey(pos))
         if info:
             print()
             reportKeyMatch(info, pos=pos)
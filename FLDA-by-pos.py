@@ -10,6 +10,7 @@ from random import sample
 from transposeTraces import transposeTraces, getHeader, getNodeVectors
 from SelectionVectors import getSelectionVectors, getPlaintexts, reportKeyMatch
 from RNR import RNR, getNRN
+from RelationStore import RelationStore
 
 try:
     Matrix(GF(2), 5, 5).left_kernel_matrix
@@ -81,18 +82,17 @@ def FLDA(pathToTraces, pathToFRNR, W, t=30, f=-1, begining=0, ending=0, record=1
         f=min((W+t)+50,T-W-t)
 
     ##GETTING THE NODE VECTORS
-    (NODEVECTORS, nodesToGoThrough, begining, ending) = getNodeVectors(pathToTraces, W+t+f, begining=begining, ending=ending, NonRedundantNodes=None, silent=0)
+    (PACKED, nodesToGoThrough, begining, ending) = getNodeVectors(pathToTraces, W+t+f, begining=begining, ending=ending, NonRedundantNodes=None, silent=0, mode='packed')
     numOfNodesVectors=len(nodesToGoThrough)
 
     #GETTING THE PLAINTEXTS
     PLAINTEXTS = getPlaintexts(pathToTraces)
 
     print("Reading FRNR relations from", pathToFRNR)
-    with gzip.open(pathToFRNR, "rb") as file:
-        redundant_relations = pickle.load(file)
+    redundant_relations = RelationStore(pathToFRNR)
 
     print("Read redundant filter positions:", len(redundant_relations))
-    print([red[0] for red in redundant_relations][100:150])
+    print(redundant_relations.keys[100:150].tolist())
 
     #DEDUCING THE SELECTION VECTORS
     if bytePositions == "all":
@@ -111,7 +111,7 @@ def FLDA(pathToTraces, pathToFRNR, W, t=30, f=-1, begining=0, ending=0, record=1
         masks = list(map(int, masks.split(",")))
     print("using bytes:", bytePositions)
     print("using masks:", masks)
-    SELECTIONVECTORS, INFO = getSelectionVectors(PLAINTEXTS, W+t+f, mode='fulmat', bytePositions=bytePositions, masks=masks)
+    SELECTIONVECTORS, INFO = getSelectionVectors(PLAINTEXTS, W+t+f, mode='fulmat', bytePositions=bytePositions, masks=masks, pathToTraces=pathToTraces)
     SELECTIONVECTORStr = SELECTIONVECTORS.transpose()
 
     SELECTIONVECTORS_TABLE = {}
@@ -127,32 +127,25 @@ def FLDA(pathToTraces, pathToFRNR, W, t=30, f=-1, begining=0, ending=0, record=1
     numberOfTimes=0
     nOfSkips=0
 
-    ONES = vector(GF(2), [1]*len(NODEVECTORS[0]))
-    ONESmat = Matrix(GF(2), [[1]*len(NODEVECTORS[0])])
+    ONESmat = Matrix(GF(2), [[1]*PACKED.ncols])
     ONESmatT = ONESmat.transpose()
     try:
         # start from the end, to aim for the S-box output
-        for filt_i, sr_rel in enumerate(redundant_relations[::-1]):
-            filtPos, sr_filtBy, sr_inds, sr_linIndRows, sr_ker = sr_rel
+        for filt_i in range(len(redundant_relations)):
+            filtPos, sr_filtBy, sr_inds, sr_linIndRows, sr_ker = redundant_relations[len(redundant_relations)-1-filt_i]
+            sr_ker = sr_ker.toSage()
             # print("filtpos", filtPos, "nvecs", sr_ker.nrows(), "            ")
             # print("sr_inds", sr_inds)
             # print(sr_ker.str())
             # print()
             # print()
             t1=time()
-            matrixArray=NODEVECTORS[sr_inds]#.stack(ONESmat)
-            Window=Matrix(GF(2), matrixArray).transpose()
-
             #Flitering
-            filtVector=NODEVECTORS[filtPos,:W+t+f][0]
-            if sr_filtBy == 1:
-                filtColIdx=filtVector.support()[:W+t]
-            else:
-                filtColIdx=(ONES-filtVector).support()[:W+t]
+            filtColIdx=PACKED.support(filtPos, sr_filtBy)[:W+t].tolist()
 
             if len(filtColIdx) >= W+t:
                 #Get only non redundant nodes vector and filtered traces of the window:
-                WindowFilt = Window[filtColIdx]
+                WindowFilt = PACKED.window(sr_inds, filtColIdx, transposed=True).toSage()
                 Sub = WindowFilt * sr_ker.transpose()
 
                 if Sub.ncols() == 1:
@@ -4,10 +4,13 @@ import argparse
 import pathlib
 from time import time
 import pickle
+import itertools
 from random import sample
 
+import numpy as np
+
 from transposeTraces import transposeTraces, getHeader, getNodeVectors
-from SelectionVectors import getSelectionVectors, getPlaintexts, reportKeyMatch
+from SelectionVectors import getSelectionVectors, getPlaintexts, reportKeyMatch, zeroMaskParities, BIT_MASKS
 from RNR import RNR, getNRN
 
 try:
@@ -85,9 +88,9 @@ def FLDA(pathToTraces, W, t=30, f=-1, NRNonly=1, filtBy=0, begining=0, ending=0,
 
     ##GETTING THE NODE VECTORS
     if NRNonly:
-        (NODEVECTORS, nodesToGoThrough, begining, ending) = getNodeVectors(pathToTraces, W+t+f, begining=begining, ending=ending, NonRedundantNodes=NonRedundantNodes, silent=0)
+        (NODEVECTORS, nodesToGoThrough, begining, ending) = getNodeVectors(pathToTraces, W+t+f, begining=begining, ending=ending, NonRedundantNodes=NonRedundantNodes, silent=0, mode='window', window=W)
     else:
-        (NODEVECTORS, nodesToGoThrough, begining, ending) = getNodeVectors(pathToTraces, W+t+f, begining=begining, ending=ending, NonRedundantNodes=None, silent=0)
+        (NODEVECTORS, nodesToGoThrough, begining, ending) = getNodeVectors(pathToTraces, W+t+f, begining=begining, ending=ending, NonRedundantNodes=None, silent=0, mode='window', window=W)
     numOfNodesVectors=len(nodesToGoThrough)
 
     #GETTING THE PLAINTEXTS
@@ -111,8 +114,13 @@ def FLDA(pathToTraces, W, t=30, f=-1, NRNonly=1, filtBy=0, begining=0, ending=0,
     print("using bytes:", bytePositions)
     print("using masks:", masks)
     print(f"window parameters: W={W} t={t} f={f} (total traces={W+t+f})")
-    SELECTIONVECTORS, INFO = getSelectionVectors(PLAINTEXTS, W+t+f, mode='fulmat', bytePositions=bytePositions, masks=masks)
-    SELECTIONVECTORStr = SELECTIONVECTORS.transpose()
+    #With more masks than bits, only the selection vectors of the single-bit
+    #masks are multiplied, and the parities of the masks derived from them
+    maskLinear = len(masks) > len(BIT_MASKS)
+    SELECTIONVECTORS, INFO = getSelectionVectors(PLAINTEXTS, W+t+f, mode='packed', bytePositions=bytePositions, masks=BIT_MASKS if maskLinear else masks, pathToTraces=pathToTraces)
+    if maskLinear:
+        INFO = list(itertools.product(bytePositions, range(256), masks))
+    SELECTIONVECTORStr = SELECTIONVECTORS.transpose().toSage()
 
 
     #ACTUAL FLDA
@@ -124,13 +132,7 @@ def FLDA(pathToTraces, W, t=30, f=-1, NRNonly=1, filtBy=0, begining=0, ending=0,
     numberOfTimes=0
     nOfSkips=0
 
-    ONES = vector(GF(2), [1]*len(NODEVECTORS[0]))
-    ONESmat = Matrix(GF(2), [[1]*len(NODEVECTORS[0])])
     try:
-        if not NRNonly:
-            filtPosInNRNlist=0
-            while NonRedundantNodes[filtPosInNRNlist]<begining:
-                filtPosInNRNlist+=1
         filtPos=0
         while filtPos<numOfNodesVectors:
             t1=time()
@@ -140,39 +142,33 @@ def FLDA(pathToTraces, W, t=30, f=-1, NRNonly=1, filtBy=0, begining=0, ending=0,
                 inds = list(range(max(0,filtPos-halfW), min(numOfNodesVectors-1,filtPos+halfW)))
                 if filtPos in inds:
                     inds.remove(filtPos)
-                matrixArray=NODEVECTORS[inds].stack(ONESmat)
-                Window=Matrix(GF(2), matrixArray).transpose()
             else:
-                while filtPosInNRNlist < len(NonRedundantNodes) and NonRedundantNodes[filtPosInNRNlist]<filtPos+begining:
-                    filtPosInNRNlist+=1
+                filtPosInNRNlist=int(np.searchsorted(NonRedundantNodes, filtPos+begining))
                 if filtPosInNRNlist >= len(NonRedundantNodes):
                     break
                 #Get the window
-                inds=[]
-                for posInNRNlist in NonRedundantNodes[max(0,filtPosInNRNlist-halfW) : min(len(NonRedundantNodes)-1,filtPosInNRNlist+halfW)]:
-                    inds.append(min(numOfNodesVectors-1,max(0,(posInNRNlist-begining))))
+                inds=np.clip(NonRedundantNodes[max(0,filtPosInNRNlist-halfW) : min(len(NonRedundantNodes)-1,filtPosInNRNlist+halfW)]-begining, 0, numOfNodesVectors-1).tolist()
                 if filtPos in inds:
                     inds.remove(filtPos)
-                matrixArray=NODEVECTORS[inds].stack(ONESmat)
-                Window=Matrix(GF(2), matrixArray).transpose()
 
             #Flitering
-            filtVector=NODEVECTORS[filtPos,:W+t+f][0]
-            if filtBy == 1:
-                filtColIdx=filtVector.support()[:W+t]
-            else:
-                filtColIdx=(ONES-filtVector).support()[:W+t]
+            filtColIdx=NODEVECTORS.support(filtPos, filtBy)[:W+t].tolist()
 
             if len(filtColIdx) >= W+t:
-                #Get only non redundant nodes vector and filtered traces of the window:
-                WindowFilt = Window[filtColIdx]
+                #Get only non redundant nodes vector and filtered traces of the window
+                #(traces x nodes, and a last column of ones):
+                WindowFilt = NODEVECTORS.window(inds, filtColIdx, ones=True, transposed=True).toSage()
 
                 #LDA
                 PCM=left_kernel_matrix(WindowFilt)
 
                 selVectors = PCM * SELECTIONVECTORStr[filtColIdx]
-                for guess, selParity in enumerate(selVectors.transpose()):
-                    if selParity.is_zero():
+                if maskLinear:
+                    zeroParities = zeroMaskParities(selVectors, masks).ravel()
+                else:
+                    zeroParities = [selParity.is_zero() for selParity in selVectors.transpose()]
+                for guess, isZero in enumerate(zeroParities):
+                    if isZero:
                         print('\033[1A', end='\x1b[2K')
                         print('\033[1A', end='\x1b[2K')
                         print('\033[1A', end='\x1b[2K')
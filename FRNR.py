@@ -7,9 +7,13 @@ import pickle
 import gzip
 from random import sample
 
-from transposeTraces import transposeTraces, getHeader, getNodeVectors
+import numpy as np
+
+from transposeTraces import transposeTraces, getHeader, getNodeVectors, recordArtifact
 from SelectionVectors import getSelectionVectors, getPlaintexts, reportKeyMatch
 from RNR import RNR, getNRN, reduceVectors
+from RelationStore import RelationWriter, RelationStore
+from PackedMatrix import PackedMatrix
 
 try:
     Matrix(GF(2), 5, 5).left_kernel_matrix
@@ -22,10 +26,7 @@ except AttributeError:
 
 def FRNR(pathToTraces, W, t=30, f=-1, NRNonly=1, filtBy=0, save_relations=False, save_independent=False, baseNRNpath=None, skip_relations=None, output_friendly=False):
     if skip_relations:
-        with gzip.open(skip_relations, "rb") as fsr:
-            skip_relations = pickle.load(fsr)[::-1]
-    else:
-        skip_relations = ()
+        skip_relations = RelationStore(skip_relations)
 
     #RECOVERING THE HEADER OF THE NODE VECTORS FILE
     (numOfNodes, T)=getHeader(pathToTraces)
@@ -47,9 +48,9 @@ def FRNR(pathToTraces, W, t=30, f=-1, NRNonly=1, filtBy=0, save_relations=False,
 
     ##GETTING THE NODE VECTORS
     if NRNonly:
-        (NODEVECTORS, nodesToGoThrough, begining, ending) = getNodeVectors(pathToTraces, W+t+f, NonRedundantNodes=NonRedundantNodes, silent=0)
+        (NODEVECTORS, nodesToGoThrough, begining, ending) = getNodeVectors(pathToTraces, W+t+f, NonRedundantNodes=NonRedundantNodes, silent=0, mode='window', window=W)
     else:
-        (NODEVECTORS, nodesToGoThrough, begining, ending) = getNodeVectors(pathToTraces, W+t+f, NonRedundantNodes=None, silent=0)
+        (NODEVECTORS, nodesToGoThrough, begining, ending) = getNodeVectors(pathToTraces, W+t+f, NonRedundantNodes=None, silent=0, mode='window', window=W)
     numOfNodesVectors=len(nodesToGoThrough)
 
 
@@ -57,105 +58,96 @@ def FRNR(pathToTraces, W, t=30, f=-1, NRNonly=1, filtBy=0, save_relations=False,
     numberOfTimes=0
     nOfSkips=0
 
-    redundant_relations = []
+    #The relations are written into the relation store while they are found
+    if save_relations:
+        frel = pathToTraces / ("FRNrel_W%04d.rel" % W)
+        print("Saving FRNR relations to", frel)
+    redundant_relations = RelationWriter(frel) if save_relations else None
     independent_pairs = []
 
     nPositionsWithRedundant = 0
     nRedundant = 0
     nIndependent = 0
 
-    ONES = vector(GF(2), [1]*len(NODEVECTORS[0]))
-    ONESmat = Matrix(GF(2), [[1]*len(NODEVECTORS[0])])
-
-    if not NRNonly:
-        filtPosInNRNlist=0
-        while NonRedundantNodes[filtPosInNRNlist]<begining:
-            filtPosInNRNlist+=1
-    filtPos=0
-    while filtPos<numOfNodesVectors:
-        t1=time()
-
-        if NRNonly:
-            #Get the window
-            inds = list(range(max(0,filtPos-halfW), min(numOfNodesVectors-1,filtPos+halfW)))
-        else:
-            while filtPosInNRNlist < len(NonRedundantNodes) and NonRedundantNodes[filtPosInNRNlist]<filtPos+begining:
-                filtPosInNRNlist+=1
-            if filtPosInNRNlist >= len(NonRedundantNodes):
-                break
-            #Get the window
-            inds=[]
-            for posInNRNlist in NonRedundantNodes[max(0,filtPosInNRNlist-halfW) : min(len(NonRedundantNodes)-1,filtPosInNRNlist+halfW)]:
-                inds.append(min(numOfNodesVectors-1,max(0,(posInNRNlist-begining))))
-
-        if skip_relations and skip_relations[-1][0] == filtPos:
-            sr_filtPos, sr_filtBy, sr_inds, sr_linIndRows, sr_ker = skip_relations[-1]
-            assert sr_filtBy == filtBy, "need to use the same filtBy in relations!"
-            # orig = len(inds)
-            # print(len(inds), "red", sr_ker.nrows(), " xxxxxxxxxxxxxxxxxxxx")
-            inds = sorted(set(inds) & {sr_inds[i] for i in sr_linIndRows})
-            # print(len(inds), "\n\n\n")
-            # assert len(inds) == l0 - sr_ker.nrows()
-            skip_relations.pop()
-
-
-
-        if filtPos in inds:
-            inds.remove(filtPos)
-
-        matrixArray=NODEVECTORS[inds]
-        Window=Matrix(GF(2), matrixArray).transpose()
-
-        #Flitering
-        filtVector=NODEVECTORS[filtPos,:W+t+f][0]
-        if filtBy == 1:
-            filtColIdx=filtVector.support()[:W+t]
-        else:
-            filtColIdx=(ONES-filtVector).support()[:W+t]
-
-        if len(filtColIdx) >= W+t:
-            #Get only non redundant nodes vector and filtered traces of the window:
-            WindowFilt = Window[filtColIdx].transpose()
-            WindowFilt -= WindowFilt.column(0).outer_product(ONES[:WindowFilt.ncols()])
-
-            linIndRows, ker = reduceVectors(WindowFilt, with_kernel=True)
-
-            nPositionsWithRedundant += int(bool(ker))
-            nRedundant += ker.nrows()
-            nIndependent += Window.nrows() - ker.nrows()
-            if save_relations and ker:
-                redundant_relations.append((filtPos, filtBy, inds, linIndRows, ker))
-            if save_independent and linIndRows:
-                independent_pairs.append((filtPos, linIndRows))
-        else:
-            nOfSkips+=1
-
-        t2=time()
-        SUMtime+=t2-t1
-        numberOfTimes+=1
-
-        if not output_friendly:
-            print('\033[1A', end='\x1b[2K')
-            print("node %d/%d (%.2f%%), filter positions with redundants %d (total redundant %d, independent %d)" % (nodesToGoThrough[filtPos], numOfNodes, 100*(filtPos)/(numOfNodesVectors), nPositionsWithRedundant, nRedundant, nIndependent))
-            timeRemaining=SUMtime/numberOfTimes*(numOfNodesVectors-filtPos)
-            print("Skips:%d (%.2f%%), estimated remaining time: %dh%dm%.2fs                         " % (nOfSkips, 100*nOfSkips/(filtPos+1), timeRemaining//3600, (timeRemaining//60)%60, timeRemaining%60), end = "\r")
-            # print("filtPos", filtPos, "inds", inds, "\n\n\n")
-        filtPos+=1
+    #The relations found so far are written even if the run is interrupted
+    try:
+        filtPos=0
+        while filtPos<numOfNodesVectors:
+            t1=time()
+
+            if NRNonly:
+                #Get the window
+                inds = list(range(max(0,filtPos-halfW), min(numOfNodesVectors-1,filtPos+halfW)))
+            else:
+                filtPosInNRNlist=int(np.searchsorted(NonRedundantNodes, filtPos+begining))
+                if filtPosInNRNlist >= len(NonRedundantNodes):
+                    break
+                #Get the window
+                inds=np.clip(NonRedundantNodes[max(0,filtPosInNRNlist-halfW) : min(len(NonRedundantNodes)-1,filtPosInNRNlist+halfW)]-begining, 0, numOfNodesVectors-1).tolist()
+
+            sr_i = skip_relations.find(filtPos) if skip_relations else -1
+            if sr_i >= 0:
+                sr_filtPos, sr_filtBy, sr_inds, sr_linIndRows, sr_ker = skip_relations[sr_i]
+                assert sr_filtBy == filtBy, "need to use the same filtBy in relations!"
+                # orig = len(inds)
+                # print(len(inds), "red", sr_ker.nrows(), " xxxxxxxxxxxxxxxxxxxx")
+                inds = sorted(set(inds) & {sr_inds[i] for i in sr_linIndRows})
+                # print(len(inds), "\n\n\n")
+                # assert len(inds) == l0 - sr_ker.nrows()
+
+
+
+            if filtPos in inds:
+                inds.remove(filtPos)
+
+            #Flitering
+            filtColIdx=NODEVECTORS.support(filtPos, filtBy)[:W+t].tolist()
+
+            if len(filtColIdx) >= W+t:
+                #Get only non redundant nodes vector and filtered traces of the window,
+                #reduced by the all-ones vector (nodes x traces):
+                WindowFilt = NODEVECTORS.window(inds, filtColIdx, affine=True).toSage()
+
+                linIndRows, ker = reduceVectors(WindowFilt, with_kernel=True)
+
+                nPositionsWithRedundant += int(bool(ker))
+                nRedundant += ker.nrows()
+                nIndependent += NODEVECTORS.ncols - ker.nrows()
+                if save_relations and ker:
+                    redundant_relations.append(inds, filtPos, filtBy, linIndRows, PackedMatrix.fromSage(ker))
+                if save_independent and linIndRows:
+                    independent_pairs.append((filtPos, linIndRows))
+            else:
+                nOfSkips+=1
+
+            t2=time()
+            SUMtime+=t2-t1
+            numberOfTimes+=1
+
+            if not output_friendly:
+                print('\033[1A', end='\x1b[2K')
+                print("node %d/%d (%.2f%%), filter positions with redundants %d (total redundant %d, independent %d)" % (nodesToGoThrough[filtPos], numOfNodes, 100*(filtPos)/(numOfNodesVectors), nPositionsWithRedundant, nRedundant, nIndependent))
+                timeRemaining=SUMtime/numberOfTimes*(numOfNodesVectors-filtPos)
+                print("Skips:%d (%.2f%%), estimated remaining time: %dh%dm%.2fs                         " % (nOfSkips, 100*nOfSkips/(filtPos+1), timeRemaining//3600, (timeRemaining//60)%60, timeRemaining%60), end = "\r")
+                # print("filtPos", filtPos, "inds", inds, "\n\n\n")
+            filtPos+=1
+    finally:
+        if redundant_relations is not None:
+            redundant_relations.close()
+
     print("                                                                                         ", end="\r")
 
     print("Finished!")
 
     if save_relations:
-        frel = pathToTraces / ("FRNrel_W%04d.pkl.gz" % W)
-        print("Saving FRNR relations to", frel)
-        with gzip.open(frel, "wb", compresslevel=1) as file:
-            pickle.dump(redundant_relations, file)
+        recordArtifact(pathToTraces, frel.name, "FRNrel", W=W, t=t, f=f, NRNonly=NRNonly, filtBy=filtBy, positions=len(redundant_relations))
 
     if save_independent:
         frel = pathToTraces / ("FNRN_W%04d.pkl.gz" % W)
         print("Saving FRNR independent to", frel)
         with gzip.open(frel, "wb", compresslevel=1) as file:
             pickle.dump(independent_pairs, file)
+        recordArtifact(pathToTraces, frel.name, "FNRN", W=W, t=t, f=f, NRNonly=NRNonly, filtBy=filtBy)
 
 
 if __name__ == '__main__' and '__file__' in globals():
@@ -201,12 +193,12 @@ if __name__ == '__main__' and '__file__' in globals():
 
     parser.add_argument(
         '--save-relations', action='store_true',
-        help="Save redundant relations in a pickle file",
+        help="Save redundant relations in a relation store FRNrel_Wx.rel",
     )
 
     parser.add_argument(
         '--skip-relations', type=pathlib.Path, default=None,
-        help="Skip redundant relations from a pickle file",
+        help="Skip redundant relations from a relation store",
     )
 
     parser.add_argument(
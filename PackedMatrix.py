@@ -0,0 +1,138 @@
+import numpy as np
+
+from transposeTraces import transposeBits
+
+#Number of bits set in each byte value
+POPCOUNT8 = np.array([bin(x).count("1") for x in range(256)], dtype=np.uint8)
+
+
+#PackedMatrix is a matrix over GF(2) whose rows (node vectors, selection
+#vectors...) are packed into a contiguous nrows x nwords uint64 array.
+#The bytes of a row follow the layout of the rows of nodeVectors.bin: the
+#column j is the bit 7-j%8 of the byte j//8. The unused bits at the end of
+#each row are always zero, so that rows can be compared, hashed and XORed
+#word by word.
+class PackedMatrix:
+    def __init__(self, words, ncols):
+        assert words.dtype == np.uint64 and words.ndim == 2
+        assert words.shape[1] == (ncols+63)//64
+        self.words = words
+        self.ncols = ncols
+
+    #Builds a matrix from packed rows of bytes (e.g. rows of nodeVectors.bin),
+    #keeping their first ncols bits. The rows are used without copy when they
+    #are contiguous and exactly fill whole words.
+    @classmethod
+    def fromBytes(cls, rows, ncols):
+        nrows = rows.shape[0]
+        nbytes = 8*((ncols+63)//64)
+        if rows.shape[1] == nbytes and ncols == 8*nbytes and rows.flags.c_contiguous:
+            return cls(rows.view(np.uint64), ncols)
+        padded = np.zeros((nrows, nbytes), dtype=np.uint8)
+        used = (ncols+7)//8
+        padded[:, :used] = rows[:, :used]
+        if ncols % 8:
+            padded[:, used-1] &= (0xFF << (8 - ncols%8)) & 0xFF
+        return cls(padded.view(np.uint64), ncols)
+
+    #Builds a matrix from a nrows x ncols array of 0/1 values
+    @classmethod
+    def fromBits(cls, bits):
+        bits = np.asarray(bits, dtype=np.uint8).reshape(len(bits), -1)
+        return cls.fromBytes(np.packbits(bits, axis=1), bits.shape[1])
+
+    #Builds a matrix from a Sage matrix over GF(2)
+    @classmethod
+    def fromSage(cls, mat):
+        bits = np.asarray(mat.numpy(dtype=np.uint8)).reshape(mat.nrows(), mat.ncols())
+        return cls.fromBits(bits)
+
+    @classmethod
+    def zeros(cls, nrows, ncols):
+        return cls(np.zeros((nrows, (ncols+63)//64), dtype=np.uint64), ncols)
+
+    def nrows(self):
+        return self.words.shape[0]
+
+    def __len__(self):
+        return self.words.shape[0]
+
+    #Rows of the matrix as bytes (nrows x 8*nwords uint8 view, no copy)
+    def bytes(self):
+        return self.words.view(np.uint8)
+
+    #Unpacked nrows x ncols array of 0/1 values
+    def bits(self):
+        return np.unpackbits(self.bytes(), axis=1, count=self.ncols)
+
+    #Row i as a bytes object, usable as a dictionary key
+    def rowKey(self, i):
+        return self.words[i].tobytes()
+
+    #Row gather: the submatrix made of the given rows (indexes, slice or mask)
+    def rows(self, indexes):
+        return PackedMatrix(np.ascontiguousarray(self.words[indexes]), self.ncols)
+
+    #The submatrix made of the first ncols columns
+    def prefix(self, ncols):
+        assert ncols <= self.ncols
+        return PackedMatrix.fromBytes(self.bytes()[:, :(ncols+7)//8], ncols)
+
+    #Column subset: the submatrix made of the given columns, in the given order
+    def columns(self, indexes):
+        if isinstance(indexes, slice):
+            indexes = range(self.ncols)[indexes]
+        indexes = np.asarray(indexes, dtype=np.int64)
+        bits = np.unpackbits(self.bytes(), axis=1)[:, indexes]
+        return PackedMatrix.fromBytes(np.packbits(bits, axis=1), len(indexes))
+
+    #Filtered window: the rows indexes restricted to the given columns (in this
+    #order, e.g. the support of a filter row), as a matrix of len(indexes) rows,
+    #plus a last row of ones with ones=True, or as its transpose with
+    #transposed=True. With affine=True, each row is XORed with its first column
+    #(reduced by the all-ones vector) before. Only the bytes holding the columns
+    #are gathered and unpacked, in place of converting the whole rows and
+    #transposing, stacking and filtering the converted matrix.
+    def window(self, indexes, columns, ones=False, affine=False, transposed=False):
+        indexes = np.asarray(indexes, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        byteIndexes, position = np.unique(columns // 8, return_inverse=True)
+        rows = self.bytes()[indexes[:, None], byteIndexes[None, :]]
+        bits = np.unpackbits(rows, axis=1)[:, 8*position.ravel() + columns % 8]
+        if affine:
+            bits ^= bits[:, :1]
+        if ones:
+            bits = np.concatenate([bits, np.ones((1, len(columns)), dtype=np.uint8)])
+        if transposed:
+            bits = bits.T
+        return PackedMatrix.fromBytes(np.packbits(bits, axis=1), bits.shape[1])
+
+    #Indexes of the columns equal to value in the row i
+    def support(self, i, value=1):
+        bits = np.unpackbits(self.bytes()[i], count=self.ncols)
+        return np.flatnonzero(bits == value)
+
+    #Row-wise XOR with a matrix of the same shape, or with a single row
+    def __xor__(self, other):
+        assert self.ncols == other.ncols
+        return PackedMatrix(self.words ^ other.words, self.ncols)
+
+    #Number of ones of each row
+    def popcount(self):
+        return POPCOUNT8[self.bytes()].sum(axis=1, dtype=np.int64)
+
+    #Transposed matrix, computed by 8x8 bit blocks
+    def transpose(self):
+        nbytes = (self.ncols+7)//8
+        transposed = transposeBits(self.bytes()[:, :nbytes])[:self.ncols]
+        return PackedMatrix.fromBytes(transposed, self.nrows())
+
+    #Conversion into a Sage matrix over GF(2)
+    def toSage(self):
+        from sage.all import Matrix, GF
+        if not self.nrows() or not self.ncols:
+            return Matrix(GF(2), self.nrows(), self.ncols)
+        return Matrix(GF(2), self.bits())
+
+    def __repr__(self):
+        return "PackedMatrix(%d x %d)" % (self.nrows(), self.ncols)
@@ -3,11 +3,14 @@ import argparse
 import pathlib
 import pickle
 import fnmatch
+import multiprocessing
 from time import time
+import numpy as np
 
 from sage.all import Matrix, GF, floor, vector
 
-from transposeTraces import  getHeader, getNodeVectors
+from transposeTraces import  getHeader, getNodeVectors, addNodeVectorsIndex, getDedupNodes, getDedupRelations, findArtifacts, recordArtifact
+from RelationStore import RelationWriter, RelationStore
 
 #@TODO
 def reduceVectors(vectors, with_kernel=True):
@@ -49,9 +52,14 @@ def reduceVectors(vectors, with_kernel=True):
 
 
 #bestNRNfile allows to find the best pickle file containing the indexes of the
-#non-redundant nodes, using their names. It returns the window size that has
-#been used to create this file with RNR.
-def bestNRNfile(pathToTraces):
+#non-redundant nodes, using the manifest, or their names for the traces
+#prepared before it. It returns the window size that has been used to create
+#this file with RNR. With below, only the windows smaller than below are
+#considered, e.g. to refine an NRN file of a smaller window.
+def bestNRNfile(pathToTraces, below=None):
+    artifacts = findArtifacts(pathToTraces, "NRN")
+    if artifacts is not None:
+        return max((entry["W"] for entry in artifacts.values() if below is None or entry["W"] < below), default=0)
     correspondingFiles = []
     #Getting all the files called NRN_W
     for root, dirs, files in os.walk(pathToTraces):
@@ -59,38 +67,44 @@ def bestNRNfile(pathToTraces):
             if fnmatch.fnmatch(name, 'NRN_W*.pkl'):
                 correspondingFiles.append(os.path.join(root, name))
     maxValue=0
-    if len(correspondingFiles)>1:
-        #Getting the biggest value for W
-        for file in correspondingFiles:
-            value=int(file[-8:-4])
-            if value>maxValue:
-                maxValue=value
-    elif len(correspondingFiles)==1:
-        maxValue=int(correspondingFiles[0][-8:-4])
+    #Getting the biggest value for W
+    for file in correspondingFiles:
+        value=int(file[-8:-4])
+        if value>maxValue and (below is None or value<below):
+            maxValue=value
     return maxValue
 
 
 #Given the path of a folder containing the NRN file, getNRN will load into a
-#list all the indexes of the non redundant nodes.
+#sorted numpy array all the indexes of the non redundant nodes.
 def getNRN(pathToTraces):
     (numOfNodes, T)=getHeader(pathToTraces)
     maxValue=bestNRNfile(pathToTraces)
     if maxValue==0:
-        #If no NRN file exists, returns all the list of all the node indexes
-        return list(range(numOfNodes))
+        #If no NRN file exists, returns all the list of all the node indexes,
+        #but the ones found redundant by the dedup index if there is one
+        dedupNodes=getDedupNodes(pathToTraces)
+        if dedupNodes is not None:
+            return np.asarray(dedupNodes, dtype=np.int64)
+        return np.arange(numOfNodes, dtype=np.int64)
     else:
-        #Else, we open the pickle file and load it in the list
+        #Else, we open the pickle file and load it in the array
         fNRN = pathToTraces / ("NRN_W%04d.pkl" % maxValue)
         with open(fNRN, "rb") as file:
-            return pickle.load(file)
+            return np.asarray(pickle.load(file), dtype=np.int64)
 
 
-#@TODO
+#Same as bestNRNfile for the relation stores RNrel_Wx.rel
 def bestRNrelFile(pathToTraces):
+    artifacts = findArtifacts(pathToTraces, "RNrel")
+    if artifacts is not None:
+        if not artifacts:
+            raise IOError("RNrel file not found")
+        return max(entry["W"] for entry in artifacts.values())
     correspondingFiles = []
     for root, dirs, files in os.walk(pathToTraces):
-        for name in files:
-            if fnmatch.fnmatch(name, 'RNrel_W*.pkl'):
+        for name in dirs:
+            if fnmatch.fnmatch(name, 'RNrel_W*.rel'):
                 correspondingFiles.append(os.path.join(root, name))
     if not correspondingFiles:
         raise IOError("RNrel file not found")
@@ -105,23 +119,25 @@ def bestRNrelFile(pathToTraces):
     return maxValue
 
 
-#@TODO
+#Returns the relation store (see RelationStore.py) of the largest window
 def getNRrel(pathToTraces):
-    maxValue=bestNRNfile(pathToTraces)
-    fNRN = pathToTraces / ("RNrel_W%04d.pkl" % maxValue)
-    with open(fNRN, "rb") as file:
-        return pickle.load(file)
+    maxValue=bestRNrelFile(pathToTraces)
+    return RelationStore(pathToTraces / ("RNrel_W%04d.rel" % maxValue))
 
 #Main implementation of RNR, see the ReadMe file for more details about the inputs
-def RNR(pathToTraces, W=-1, S=-1, t=30, save_relations=False, ignoreExisting=False, extraNRN=None, affine=False):
+#With jobs>1, the nodes are processed by segments in parallel (see parallelRNR).
+def RNR(pathToTraces, W=-1, S=-1, t=30, save_relations=False, ignoreExisting=False, extraNRN=None, affine=False, jobs=1, tune=None):
 
     #RECOVERING THE HEADER OF THE NODE VECTORS FILE: number of traces and nodes
     (numOfNodes, T) = getHeader(pathToTraces)
     totalNumOfNodes = numOfNodes
 
     #VERIFYING INPUT PARAMETER
-    W=min(W, numOfNodes)
     maxWValue=floor(T-t)
+    if tune:
+        #W and S are chosen by tuneRNR, up to the upper bound
+        (Wmin, W) = (tune[0], min(tune[1], maxWValue))
+    W=min(W, numOfNodes)
     if W>maxWValue:
         print("/!\\ Not enough traces to perform RNR with window size W=%d /!\\" % W)
         print("With the available T=%d traces, you can choose W%d at maximum." % (T,maxWValue))
@@ -139,126 +155,78 @@ def RNR(pathToTraces, W=-1, S=-1, t=30, save_relations=False, ignoreExisting=Fal
     if ignoreExisting:
         maxValue = 0
     else:
-        maxValue = bestNRNfile(pathToTraces)
+        if not tune and bestNRNfile(pathToTraces, W+1)==W:
+            print("A file containing indices for non redundant nodes (NRN) already exists for W=%d" % W)
+            return
+        #RNR is run on the NRN file of the largest window below W, if any
+        maxValue = bestNRNfile(pathToTraces, W)
+
+    if tune:
+        Wmin=max(1, Wmin, maxValue+1)
+        if Wmin>W:
+            print("/!\\ No window size to tune between W=%d and W=%d /!\\" % (Wmin, W))
+            return
 
-    if maxValue>=W:
-        print("A better file containing indices for non redundant nodes (NRN) already exists for W=%d" % maxValue)
-        return
+    #@TODO
+    if extraNRN:
+        with open(extraNRN, "rb") as file:
+            extraNRN=sorted(set(pickle.load(file)))
 
     #OPENNING AN EXISTING NRN FILE IF IT EXISTS TO RUN RNR ONTO IT
+    dedupRelations=[]
     if maxValue==0:
-        NonRedundantNodes=list(range(numOfNodes))
+        #Skipping the constant, duplicate and complemented nodes of the dedup
+        #index, among the nodes of the extra NRN file if there is one
+        NonRedundantNodes=getDedupNodes(pathToTraces, affine, extraNRN or None)
+        if NonRedundantNodes is None:
+            NonRedundantNodes=list(range(numOfNodes))
+        else:
+            print("Skipping %d nodes found redundant by the dedup index" % (len(extraNRN or range(numOfNodes))-len(NonRedundantNodes)))
+            if save_relations:
+                dedupRelations=getDedupRelations(pathToTraces, affine, set(extraNRN) if extraNRN else None)
     else:
         fNRN = pathToTraces / ("NRN_W%04d.pkl" % maxValue)
         with open(fNRN, "rb") as file:
             NonRedundantNodes=pickle.load(file)
         numOfNodes=len(NonRedundantNodes)
 
-    #@TODO
     if extraNRN:
-        with open(extraNRN, "rb") as file:
-            extraNRN=pickle.load(file)
-            orig = len(NonRedundantNodes)
-            NonRedundantNodes=sorted(set(NonRedundantNodes) & set(extraNRN))
-            print("reduced NRN using extra file:", orig, "->", len(NonRedundantNodes))
-    reverseQueue = list(reversed(NonRedundantNodes))
-
-    NonRedundantNodes = []
+        orig = len(NonRedundantNodes)
+        NonRedundantNodes=sorted(set(NonRedundantNodes) & set(extraNRN))
+        print("reduced NRN using extra file:", orig, "->", len(NonRedundantNodes))
+    nodes = list(NonRedundantNodes)
     T=W+t
-    SUMtime=0
-    numberOfTimes=0
 
     #GETTING THE NODE VECTORS
-    NODEVECTORS = getNodeVectors(pathToTraces, T)[0]
-
-    if save_relations:
-        redundant_relations = []
-
-    slidingWindowPosition=0
-    removedNodes=0
-
-    ONES = vector(GF(2), [1]*len(NODEVECTORS[0]))
-
-    #PREPARING FIRST WINDOW
-    XORnodesRemoved=True
-    while XORnodesRemoved:
-        XORnodesRemoved=False
-
-        indexes=revQueuePopN(reverseQueue, W-S)
-        windowMatrix=NODEVECTORS[indexes]
-        if affine:
-            # reduce node vectors (rows) by the all-constant vector
-            windowMatrix -= windowMatrix.column(0).outer_product(ONES)
-        linIndRows, ker = reduceVectors(windowMatrix, with_kernel=save_relations)
-
-        if len(linIndRows)<len(indexes):
-            XORnodesRemoved=True
-
-        # return back independent indexes
-        for index in reversed(linIndRows):
-            globalIndex = indexes[index]
-            reverseQueue.append(globalIndex)
-        for index in linIndRows:
-            globalIndex = indexes[index]
-            if (not NonRedundantNodes) or globalIndex > NonRedundantNodes[-1]:
-                NonRedundantNodes.append(globalIndex)
-        removedNodes += len(indexes) - len(linIndRows)
-
-        if save_relations:
-            for row in ker:
-                relation = [index for index, take in zip(indexes, row) if take]
-                redundant_relations.append(relation)
+    PACKED = getNodeVectors(pathToTraces, T, mode='packed')[0]
+    if tune:
+        (W, S, schedule) = tuneRNR(PACKED, t, affine, nodes, Wmin, W)
+        T=W+t
+        PACKED = PACKED.prefix(T)
+    initRNR(PACKED.bytes(), T, affine, nodes)
+    del PACKED
 
     #ACTUAL REDUNDANT NODES REMOVAL
     print("Removing redundant nodes for window size W=%d t=%d  on T=%d traces                   " % (W, t, T))
 
-    t0 = time()
-    SUMtime=0
-    numberOfTimes=0
-
-
-    while reverseQueue:
-        t1=time()
-
-        indexes=revQueuePopN(reverseQueue, W)
-        slidingWindowPosition = indexes[0]
-        windowMatrix=NODEVECTORS[indexes]
-        if affine:
-            # reduce node vectors (rows) by the all-constant vector
-            windowMatrix -= windowMatrix.column(0).outer_product(ONES)
-        linIndRows, ker = reduceVectors(windowMatrix, with_kernel=save_relations)
-
-        wasEmptied = not reverseQueue
-
-        # return back independent indexes
-        for index in reversed(linIndRows):
-            globalIndex = indexes[index]
-            reverseQueue.append(globalIndex)
-        for index in linIndRows:
-            globalIndex = indexes[index]
-            if (not NonRedundantNodes) or globalIndex > NonRedundantNodes[-1]:
-                NonRedundantNodes.append(globalIndex)
-        removedNodes += len(indexes) - len(linIndRows)
+    #The relations are written into the relation store while they are found
+    relations = None
+    if save_relations:
+        relations = RelationWriter(pathToTraces / ("RNrel_W%04d.rel" % W))
+        relations.extend(dedupRelations)
 
+    t0 = time()
+    #The relations found so far are written even if the run is interrupted
+    try:
+        if jobs > 1:
+            (NonRedundantNodes, relations, removedNodes) = parallelRNR(W, S, save_relations, jobs, relations)
+        else:
+            (NonRedundantNodes, relations, removedNodes, *_) = slidingRNR(W, S, save_relations, numOfNodes=numOfNodes, relations=relations)
+    finally:
         if save_relations:
-            for row in ker:
-                relation = [index for index, take in zip(indexes, row) if take]
-                redundant_relations.append(relation)
-
-        # slide W//6 vectors
-        revQueuePopN(reverseQueue, S)
-
-        if wasEmptied:
-            reverseQueue.clear()
-
-        t2=time()
-        SUMtime+=t2-t1
-        numberOfTimes+=1
-        percentDone=max(slidingWindowPosition,1)/numOfNodes
-        remainingTime=((1-percentDone)/percentDone)*SUMtime
-
-        if numberOfTimes%32==0:
-            print("[.] node %d/%d (%.2f%%), number of removed XOR nodes so far: %d (%.2f%%), estimated remaining time: %dh%02dm%fs" % (slidingWindowPosition, numOfNodes, percentDone*100, removedNodes, 100*removedNodes/(slidingWindowPosition), remainingTime//3600, (remainingTime//60)%60, remainingTime%60), end="\r")
+            relations.close()
+    if save_relations:
+        recordArtifact(pathToTraces, "RNrel_W%04d.rel" % W, "RNrel", W=W, S=S, t=t, affine=affine, relations=len(relations))
 
     TOTALtime = time() - t0
     print("                                                                                           ")
@@ -272,11 +240,13 @@ def RNR(pathToTraces, W=-1, S=-1, t=30, save_relations=False, ignoreExisting=Fal
     ftrace = pathToTraces / ("NRN_W%04d.pkl" % W)
     with open(ftrace, "wb") as file:
         pickle.dump(NonRedundantNodes, file)
-
-    if save_relations:
-        frel = pathToTraces / ("RNrel_W%04d.pkl" % W)
-        with open(frel, "wb") as file:
-            pickle.dump(redundant_relations, file)
+    addNodeVectorsIndex(pathToTraces, "NRN_W%04d" % W, NonRedundantNodes)
+    recordArtifact(pathToTraces, "NRN_W%04d.pkl" % W, "NRN", W=W, S=S, t=t, affine=affine, nodes=len(NonRedundantNodes))
+    if tune:
+        ftune = pathToTraces / ("NRNtune_W%04d.pkl" % W)
+        with open(ftune, "wb") as file:
+            pickle.dump({"W": W, "S": S, "t": t, "bounds": (Wmin, tune[1]), "nodes": min(len(nodes), TUNE_NODES), "candidates": schedule}, file)
+        recordArtifact(pathToTraces, "NRNtune_W%04d.pkl" % W, "NRNtune", W=W, S=S)
 
     if maxValue>0:
         #os.remove(args.trace_dir / ("NRN_W%04d.pkl" % maxValue))
@@ -284,6 +254,230 @@ def RNR(pathToTraces, W=-1, S=-1, t=30, save_relations=False, ignoreExisting=Fal
         print("Total number of removed node from the original file: %d (%.2f%%)" % (totalNumOfNodes-len(NonRedundantNodes), 100*(totalNumOfNodes-len(NonRedundantNodes))/totalNumOfNodes))
 
 
+#Node vectors (packed rows), number of traces, affine mode and list of nodes of
+#the RNR being run, shared with the worker processes of the parallel RNR
+rnrRows = None
+rnrOnes = 0
+rnrAffine = False
+rnrNodes = None
+
+def initRNR(ROWS, T, affine, nodes):
+    global rnrRows, rnrOnes, rnrAffine, rnrNodes
+    rnrRows = ROWS
+    rnrOnes = ((1 << T) - 1) << (8*ROWS.shape[1] - T)
+    rnrAffine = affine
+    rnrNodes = nodes
+
+
+#Node vector of node as a python int (the first trace is the highest bit)
+def nodeVector(node):
+    vec = int.from_bytes(rnrRows[node].tobytes(), 'big')
+    if rnrAffine and vec >> (8*rnrRows.shape[1] - 1):
+        # reduce node vectors by the all-constant vector
+        vec ^= rnrOnes
+    return vec
+
+
+#Sliding window removal of the redundant nodes of rnrNodes from the position
+#begining, starting from the window (the non redundant nodes of the window) of
+#a previous run, or from an empty window first filled with W-S nodes.
+#The run stops at the first window starting at ending or beyond, or, given the
+#states of another run in stitch, at the first window in the same state.
+#It returns the non redundant nodes and the relations found, the number of
+#removed nodes, the state (position, window) where it stopped, and
+#the states of its windows: position -> (nodes of the window, and numbers of
+#non redundant nodes, relations and removed nodes found before it).
+#With numOfNodes, the progress is printed. The relations are appended to
+#relations (a list by default, or a RelationWriter).
+def slidingRNR(W, S, save_relations=False, begining=0, ending=None, window=None, stitch=None, numOfNodes=None, relations=None):
+    nodes = rnrNodes
+    ending = len(nodes) if ending is None else min(ending, len(nodes))
+    NonRedundantNodes = []
+    relations = [] if relations is None else relations
+    removedNodes = 0
+    states = {}
+
+    #The non redundant nodes of the current window are kept in a sliding
+    #basis, so that only the nodes entering the window are reduced
+    basis = SlidingBasis(save_relations)
+
+    def reduceNode(node):
+        vec = nodeVector(node)
+        remainder, relation = basis.reduce(vec)
+        if remainder:
+            basis.insert(vec, node)
+            window.append(node)
+            NonRedundantNodes.append(node)
+            return 0
+        if save_relations:
+            relations.append(sorted(relation | {node}))
+        return 1
+
+    pos = begining
+    if window is None:
+        #PREPARING FIRST WINDOW
+        window = []
+        while pos < len(nodes) and len(window) < W-S:
+            removedNodes += reduceNode(nodes[pos])
+            pos += 1
+    else:
+        window = list(window)
+        for node in window:
+            basis.insert(nodeVector(node), node)
+        basis.slide(window[0] if window else None)
+
+    SUMtime=0
+    numberOfTimes=0
+    while pos < ending:
+        t1=time()
+
+        state = tuple(window)
+        if stitch is not None and stitch.get(pos, (None,))[0] == state:
+            break
+        states[pos] = (state, len(NonRedundantNodes), len(relations), removedNodes)
+
+        slidingWindowPosition = window[0] if window else nodes[pos]
+        newNodes = nodes[pos:pos+W-len(window)]
+        for node in newNodes:
+            removedNodes += reduceNode(node)
+        pos += len(newNodes)
+
+        # slide W//6 vectors (when fewer nodes are left in the window, the
+        # next nodes are slid out as well, as in the window by window RNR)
+        if len(window) < S:
+            pos = min(len(nodes), pos+S-len(window))
+        del window[:S]
+        basis.slide(window[0] if window else None)
+
+        t2=time()
+        SUMtime+=t2-t1
+        numberOfTimes+=1
+
+        if numOfNodes and numberOfTimes%32==0:
+            percentDone=max(slidingWindowPosition,1)/numOfNodes
+            remainingTime=((1-percentDone)/percentDone)*SUMtime
+            print("[.] node %d/%d (%.2f%%), number of removed XOR nodes so far: %d (%.2f%%), estimated remaining time: %dh%02dm%fs" % (slidingWindowPosition, numOfNodes, percentDone*100, removedNodes, 100*removedNodes/max(slidingWindowPosition,1), remainingTime//3600, (remainingTime//60)%60, remainingTime%60), end="\r")
+
+    return NonRedundantNodes, relations, removedNodes, (pos, window), states
+
+
+#Parallel RNR: slidingRNR is run from an empty window on jobs segments of the
+#nodes at once, then the segments are stitched together. From the state where
+#the previous segment stopped, the windows are slid again until they reach a
+#state of the next segment, from which the results of this segment are the
+#ones of the serial RNR and are taken as they are. If no such state is met,
+#the whole segment is slid again, so the result is always the serial one.
+#The segments begin at multiples of S, where the windows of the serial RNR
+#begin as long as no node is removed.
+#The relations are appended to relations, as with slidingRNR.
+def parallelRNR(W, S, save_relations, jobs, relations=None):
+    numOfNodes = len(rnrNodes)
+    bounds = sorted({(numOfNodes*k//jobs)//S*S for k in range(jobs)} | {numOfNodes})
+    segments = list(zip(bounds[:-1], bounds[1:]))
+    with multiprocessing.get_context("fork").Pool(jobs) as pool:
+        results = pool.starmap(slidingRNR, [(W, S, save_relations, begining, ending) for begining, ending in segments])
+
+    (NonRedundantNodes, segmentRelations, removedNodes, (pos, window), states) = results[0]
+    relations = [] if relations is None else relations
+    relations.extend(segmentRelations)
+    stitched = 0
+    for (begining, ending), (segmentNRN, segmentRelations, segmentRemoved, segmentEnd, segmentStates) in zip(segments[1:], results[1:]):
+        (stitchNRN, stitchRelations, stitchRemoved, (pos, window), states) = slidingRNR(W, S, save_relations, pos, ending, window, segmentStates)
+        NonRedundantNodes += stitchNRN
+        relations.extend(stitchRelations)
+        removedNodes += stitchRemoved
+        if pos < min(ending, numOfNodes):
+            #Same state as the segment: its following results are the serial ones
+            (state, numNRN, numRelations, numRemoved) = segmentStates[pos]
+            NonRedundantNodes += segmentNRN[numNRN:]
+            relations.extend(segmentRelations[numRelations:])
+            removedNodes += segmentRemoved - numRemoved
+            (pos, window) = segmentEnd
+            stitched += 1
+    print("[.] %d/%d segments stitched to the previous ones" % (stitched, len(segments)-1))
+    return NonRedundantNodes, relations, removedNodes
+
+
+#Number of first nodes on which the candidate window and sliding sizes are
+#measured by tuneRNR, number of window sizes tried between the bounds, and
+#divisors of each window size W giving the sliding sizes tried with it
+TUNE_NODES = 1 << 14
+TUNE_WINDOWS = 4
+TUNE_SLIDINGS = (12, 6, 3)
+
+#Adaptive choice of the window and sliding sizes W and S, for W between Wmin
+#and Wmax: slidingRNR is run on the first TUNE_NODES nodes with each candidate
+#(geometrically spaced window sizes), and the candidate removing the most
+#nodes per second is chosen. PACKED holds the node vectors on at least Wmax+t
+#traces. Returns W, S and the measures (W, S, removed nodes, time) of all the
+#candidates.
+def tuneRNR(PACKED, t, affine, nodes, Wmin, Wmax):
+    ending = min(len(nodes), TUNE_NODES)
+    windows = sorted({round(Wmin * (Wmax/Wmin)**(k/(TUNE_WINDOWS-1))) for k in range(TUNE_WINDOWS)})
+    schedule = []
+    for W in windows:
+        initRNR(PACKED.prefix(W+t).bytes(), W+t, affine, nodes)
+        for S in sorted({max(1, W//d) for d in TUNE_SLIDINGS}):
+            t0 = time()
+            removedNodes = slidingRNR(W, S, ending=ending)[2]
+            elapsed = time() - t0
+            schedule.append((W, S, removedNodes, elapsed))
+            print("[.] tuning W=%d S=%d: %d/%d nodes removed in %.2fs" % (W, S, removedNodes, ending, elapsed))
+    (W, S, removedNodes, elapsed) = max(schedule, key=lambda measure: measure[2]/max(measure[3], 1e-6))
+    print("[✓] tuned W=%d S=%d (%.0f removed nodes per second)" % (W, S, removedNodes/max(elapsed, 1e-6)))
+    return W, S, schedule
+
+
+#Basis over GF(2) of the node vectors (python ints) of a window sliding over
+#the nodes in increasing order. Each basis vector is a combination of nodes not
+#older than its own node, and the newest nodes are kept highest in the basis:
+#the basis vectors of the nodes still in the window then span the same space
+#as these nodes, and the older ones are simply ignored once slid out.
+#With relations, each basis vector also keeps the set of nodes it combines.
+class SlidingBasis:
+    def __init__(self, relations=False):
+        self.pivots = {}
+        self.begining = 0
+        self.relations = relations
+
+    #Reduces the vector vec by the nodes of the window. Returns the remainder
+    #(0 if vec is in their span) and the set of nodes combined (with relations)
+    def reduce(self, vec):
+        relation = set()
+        while vec:
+            entry = self.pivots.get(vec.bit_length()-1)
+            if entry is None or entry[1] < self.begining:
+                break
+            vec ^= entry[0]
+            if self.relations:
+                relation ^= entry[2]
+        return vec, relation
+
+    #Adds the node vector vec of node, newer than all the nodes of the basis
+    def insert(self, vec, node):
+        relation = {node}
+        while vec:
+            pivot = vec.bit_length()-1
+            entry = self.pivots.get(pivot)
+            if entry is None or entry[1] < self.begining:
+                self.pivots[pivot] = [vec, node, relation]
+                return
+            if node > entry[1]:
+                entry[0], vec = vec, entry[0]
+                entry[1], node = node, entry[1]
+                entry[2], relation = relation, entry[2]
+            vec ^= entry[0]
+            if self.relations:
+                relation = relation ^ entry[2]
+
+    #Slides the window to begin at the node begining (None if it is empty)
+    def slide(self, begining):
+        if begining is None:
+            self.pivots.clear()
+        else:
+            self.begining = begining
+
+
 def revQueuePopN(d, N):
     assert N >= 0
     ret = list(reversed(d[-N:]))
@@ -325,7 +519,7 @@ if __name__ == '__main__':
 
     parser.add_argument(
         '--save-relations', action='store_true',
-        help="Save redundant relations in a pickle file",
+        help="Save redundant relations in a relation store RNrel_Wx.rel",
     )
 
     parser.add_argument(
@@ -333,9 +527,19 @@ if __name__ == '__main__':
         help="Do not remove affine redundancies"
     )
 
+    parser.add_argument(
+        '--tune', type=int, nargs=2, default=None, metavar=('WMIN', 'WMAX'),
+        help="Choose W and S between these window sizes from the removal rate on the first nodes (-W and -S are ignored)"
+    )
+
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help="Number of processes removing the redundant nodes of segments of the nodes in parallel"
+    )
+
 
     args = parser.parse_args()
     for trace_dir in args.trace_dirs:
         print("Processing trace folder", trace_dir)
 
-        RNR(trace_dir, extraNRN=args.NRN, W=args.Window, S=args.Sliding, t=args.falsePos, save_relations=args.save_relations, affine=not args.no_affine, ignoreExisting=True)
+        RNR(trace_dir, extraNRN=args.NRN, W=args.Window, S=args.Sliding, t=args.falsePos, save_relations=args.save_relations, affine=not args.no_affine, ignoreExisting=True, jobs=args.jobs, tune=args.tune)
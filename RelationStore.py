@@ -0,0 +1,197 @@
+import os
+import sys
+import pickle
+import gzip
+import pathlib
+
+import numpy as np
+
+from PackedMatrix import PackedMatrix
+
+#A relation store is a directory of append-only column files holding the
+#relations found by RNR and FRNR while they are found:
+# - records.bin: the header RELATIONS_HEADER, then one RECORD_DTYPE record per
+#   relation (the offset table, sorted by key for FRNR filter positions),
+# - inds.bin: the node indexes of each relation, as the first index (base)
+#   followed by the deltas between consecutive indexes, modulo 2^32, on the
+#   smallest of 1, 2 or 4 bytes holding all of them (width),
+# - bits.bin: bitRows rows of (size+7)//8 bytes for each relation: with FRNR,
+#   the mask of the linearly independent indexes then the kernel rows.
+#A record is written only after its payloads, so that a store cut by a crash
+#is read up to its last complete relation.
+RELATIONS_HEADER = b"WboxRels" + (1).to_bytes(8, 'little')
+RECORD_DTYPE = np.dtype([
+    ("key", "<i8"), ("base", "<u4"), ("size", "<u4"), ("bitRows", "<u4"),
+    ("filtBy", "u1"), ("width", "u1"), ("pad", "V2"),
+    ("indsOffset", "<u8"), ("bitsOffset", "<u8"),
+])
+#Number of relations after which the pending records are written
+RELATIONS_FLUSH = 1 << 12
+
+
+def mapFile(fileName, offset=0):
+    if os.path.getsize(fileName) <= offset:
+        return np.empty(0, dtype=np.uint8)
+    return np.memmap(fileName, dtype=np.uint8, mode='r', offset=offset)
+
+
+#Writes the relations of one run into a relation store, e.g.
+#    with RelationWriter(pathToTraces / "RNrel_W0250.rel") as relations:
+#        relations.append(sorted(relation))
+#It is also a list-like sink (append, extend, len) for slidingRNR.
+class RelationWriter:
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.records = open(self.path / "records.bin", "wb")
+        self.inds = open(self.path / "inds.bin", "wb")
+        self.bits = open(self.path / "bits.bin", "wb")
+        self.records.write(RELATIONS_HEADER)
+        self.records.flush()
+        self.pending = []
+        self.written = 0
+        self.indsOffset = 0
+        self.bitsOffset = 0
+
+    #Appends the relation between the nodes inds. The key defaults to the last
+    #node (the node found redundant by RNR); FRNR gives its filter position,
+    #filtBy, the indexes of the linearly independent inds (linIndRows) and the
+    #kernel (a PackedMatrix with len(inds) columns).
+    def append(self, inds, key=None, filtBy=0, linIndRows=None, kernel=None):
+        inds = np.asarray(inds, dtype=np.int64)
+        size = len(inds)
+        deltas = (np.diff(inds) % (1 << 32)).astype(np.uint32)
+        top = int(deltas.max(initial=0))
+        width = 1 if top < 1 << 8 else 2 if top < 1 << 16 else 4
+        self.inds.write(deltas.astype("<u%d" % width).tobytes())
+        bitRows = 0
+        if linIndRows is not None:
+            mask = np.zeros((1, size), dtype=np.uint8)
+            mask[0, list(linIndRows)] = 1
+            rows = [np.packbits(mask, axis=1)]
+            if kernel is not None and kernel.nrows():
+                assert kernel.ncols == size
+                rows.append(kernel.bytes()[:, :(size+7)//8])
+            rows = np.concatenate(rows)
+            self.bits.write(rows.tobytes())
+            bitRows = rows.shape[0]
+        if key is None:
+            key = inds[-1] if size else -1
+        self.pending.append((key, inds[0] if size else 0, size, bitRows, filtBy, width, b"", self.indsOffset, self.bitsOffset))
+        self.indsOffset += (size-1)*width if size else 0
+        self.bitsOffset += bitRows*((size+7)//8)
+        if len(self.pending) >= RELATIONS_FLUSH:
+            self.flush()
+
+    def extend(self, relations):
+        for relation in relations:
+            self.append(relation)
+
+    def __len__(self):
+        return self.written + len(self.pending)
+
+    def flush(self):
+        self.inds.flush()
+        self.bits.flush()
+        self.records.write(np.array(self.pending, dtype=RECORD_DTYPE).tobytes())
+        self.records.flush()
+        self.written += len(self.pending)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        for file in (self.records, self.inds, self.bits):
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+#Memory-maps a relation store, whose relations are accessed by their index:
+#store[i] is (key, filtBy, inds, linIndRows, kernel), with linIndRows and
+#kernel None for the relations of RNR.
+class RelationStore:
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        with open(self.path / "records.bin", "rb") as file:
+            if file.read(len(RELATIONS_HEADER)) != RELATIONS_HEADER:
+                raise IOError("%s is not a relation store" % self.path)
+        records = mapFile(self.path / "records.bin", len(RELATIONS_HEADER))
+        records = records[:len(records)//RECORD_DTYPE.itemsize*RECORD_DTYPE.itemsize].view(RECORD_DTYPE)
+        self.inds = mapFile(self.path / "inds.bin")
+        self.bits = mapFile(self.path / "bits.bin")
+        #Only the relations whose payloads were written completely
+        size = records["size"].astype(np.int64)
+        complete = (records["indsOffset"] + np.maximum(size-1, 0)*records["width"] <= len(self.inds)) \
+                 & (records["bitsOffset"] + records["bitRows"]*((size+7)//8) <= len(self.bits))
+        self.records = records[:len(records) if complete.all() else int(np.argmin(complete))]
+        self.keys = self.records["key"]
+
+    def __len__(self):
+        return len(self.records)
+
+    #Index of the relation of key, or -1. The keys must be increasing, as the
+    #filter positions of FRNR are.
+    def find(self, key):
+        i = int(np.searchsorted(self.keys, key))
+        return i if i < len(self.keys) and self.keys[i] == key else -1
+
+    #Node indexes of the relation i
+    def nodes(self, i):
+        record = self.records[i]
+        size, width, offset = int(record["size"]), int(record["width"]), int(record["indsOffset"])
+        if not size:
+            return np.empty(0, dtype=np.int64)
+        deltas = self.inds[offset:offset+(size-1)*width].view("<u%d" % width)
+        inds = np.empty(size, dtype=np.uint32)
+        inds[0] = record["base"]
+        inds[1:] = deltas
+        return np.cumsum(inds, dtype=np.uint32).astype(np.int64)
+
+    #Rows of bits.bin of the relation i
+    def bitRows(self, i):
+        record = self.records[i]
+        rowBytes = (int(record["size"])+7)//8
+        offset = int(record["bitsOffset"])
+        return self.bits[offset:offset+int(record["bitRows"])*rowBytes].reshape(-1, rowBytes)
+
+    def __getitem__(self, i):
+        record = self.records[i]
+        inds = self.nodes(i)
+        if not record["bitRows"]:
+            return int(record["key"]), int(record["filtBy"]), inds.tolist(), None, None
+        rows = self.bitRows(i)
+        linIndRows = np.flatnonzero(np.unpackbits(rows[0], count=len(inds))).tolist()
+        kernel = PackedMatrix.fromBytes(rows[1:], len(inds))
+        return int(record["key"]), int(record["filtBy"]), inds.tolist(), linIndRows, kernel
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+#Converts the relations pickled by the previous versions of RNR (RNrel_Wx.pkl,
+#lists of nodes) and FRNR (FRNrel_Wx.pkl.gz, tuples with a Sage kernel) into a
+#relation store.
+def convertRelations(pickleFile, path):
+    opener = gzip.open if str(pickleFile).endswith(".gz") else open
+    with opener(pickleFile, "rb") as file:
+        relations = pickle.load(file)
+    with RelationWriter(path) as writer:
+        for relation in relations:
+            if isinstance(relation, tuple):
+                (filtPos, filtBy, inds, linIndRows, ker) = relation
+                writer.append(inds, filtPos, filtBy, linIndRows, PackedMatrix.fromSage(ker))
+            else:
+                writer.append(relation)
+    return len(relations)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("usage: %s RELATIONS.pkl[.gz] STORE.rel" % sys.argv[0])
+        sys.exit(1)
+    print("%d relations converted" % convertRelations(sys.argv[1], pathlib.Path(sys.argv[2])))
@@ -1,9 +1,14 @@
 import os
 import itertools
+import hashlib
+
+import numpy as np
 
 from sage.all import VectorSpace, Matrix, GF
 from tqdm import tqdm
 
+from transposeTraces import mapPackedTexts, readCachedMatrix, writeCachedMatrix, PLAINTEXTS_FILE
+
 AESSBox = [
     0x63, 0x7C, 0x77, 0x7B, 0xF2, 0x6B, 0x6F, 0xC5, 0x30, 0x01, 0x67, 0x2B, 0xFE, 0xD7, 0xAB, 0x76,
     0xCA, 0x82, 0xC9, 0x7D, 0xFA, 0x59, 0x47, 0xF0, 0xAD, 0xD4, 0xA2, 0xAF, 0x9C, 0xA4, 0x72, 0xC0,
@@ -26,7 +31,13 @@ AESSBox = [
 def selectionFunction(plaintextByte, keyByteGuess, mask):
     return LINEAR_MAPS[mask][AESSBox[plaintextByte ^ keyByteGuess]]
 
+#Returns the plaintexts of the traces, mapped from plaintexts.bin when it is up
+#to date, or else read from the plaintext.txt file (SEL) or .pt files (BU)
 def getPlaintexts(pathToTraces):
+    PLAINTEXTS = mapPackedTexts(pathToTraces, PLAINTEXTS_FILE)
+    if PLAINTEXTS is not None:
+        return PLAINTEXTS
+
     SELorBU=0 #SEL traces = 1, BU traces = 2, not found = 0
     try:
         f = open(pathToTraces / "plaintext.txt", "rt").readlines()
@@ -84,10 +95,52 @@ def getPlaintexts(pathToTraces):
 
     return(PLAINTEXTS)
 
-def getSelectionVectors(PLAINTEXTS, T, mode='list', bytePositions=(0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15), masks=(1, 2, 4, 8, 16, 32, 64, 128)):
-    SELECTIONVECTORS=[]
-    INFO = []
-
+#Selection bits of the plaintext bytes plaintextBytes (one byte position of
+#the traces) for the 256 key guesses and the given masks, as a
+#256 x len(masks) x T uint8 array: AESSBox[pt ^ k] is gathered for all the
+#guesses at once, and the masks are applied as LINEAR_MAPS lookups.
+def selectionBits(plaintextBytes, masks):
+    sboxOutputs = SBOX_ARRAY[plaintextBytes[None, :] ^ KEY_GUESSES[:, None]]
+    return LINEAR_MAPS_ARRAY[np.asarray(masks, dtype=np.int64)][:, sboxOutputs].transpose(1, 0, 2)
+
+#Returns the first T plaintexts as a T x 16 uint8 array
+def plaintextArray(PLAINTEXTS, T):
+    if isinstance(PLAINTEXTS, np.ndarray):
+        return PLAINTEXTS[:T]
+    return np.array([list(plaintext) for plaintext in PLAINTEXTS[:T]], dtype=np.uint8)
+
+#Packed selection vectors of the byte positions bytePositions, for all the key
+#guesses and masks, in the order of INFO: (bytePosition, keyByteGuess, mask).
+#With pathToTraces, they are kept in the cache of the traces directory, keyed
+#by the plaintexts and parameters, and mapped back by the next runs. They are
+#then generated for T rounded up to a power of two, so that runs with close
+#numbers of traces (e.g. sweeps over W) share the same cached vectors.
+def packedSelectionVectors(PLAINTEXTS, T, bytePositions, masks, pathToTraces=None):
+    from PackedMatrix import PackedMatrix
+    INFO = list(itertools.product(bytePositions, range(256), masks))
+    key = None
+    generatedT = T
+    if pathToTraces is not None:
+        generatedT = min(len(PLAINTEXTS), 1 << (T-1).bit_length())
+        PLAINTEXTS = plaintextArray(PLAINTEXTS, generatedT)
+        key = hashlib.sha1(b"selection" + np.ascontiguousarray(PLAINTEXTS).tobytes() + repr((generatedT, list(bytePositions), list(masks))).encode()).hexdigest()
+        words = readCachedMatrix(pathToTraces, key)
+        if words is not None:
+            return PackedMatrix(words, generatedT).prefix(T), INFO
+    PLAINTEXTS = plaintextArray(PLAINTEXTS, generatedT)
+    rows = []
+    for bytePosition in tqdm(bytePositions):
+        rows.append(np.packbits(selectionBits(PLAINTEXTS[:, bytePosition], masks).reshape(-1, generatedT), axis=1))
+    SELECTIONVECTORS = PackedMatrix.fromBytes(np.concatenate(rows), generatedT)
+    if key is not None:
+        writeCachedMatrix(pathToTraces, key, SELECTIONVECTORS.words)
+    if generatedT != T:
+        SELECTIONVECTORS = SELECTIONVECTORS.prefix(T)
+    return SELECTIONVECTORS, INFO
+
+#With pathToTraces, the selection vectors of the modes 'mat', 'fulmat' and
+#'packed' are cached in the traces directory.
+def getSelectionVectors(PLAINTEXTS, T, mode='list', bytePositions=(0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15), masks=(1, 2, 4, 8, 16, 32, 64, 128), pathToTraces=None):
     if T>len(PLAINTEXTS):
         print("Impossible to read Plaintexts:")
         print("Only %d traces available, cannot get T=%d traces" % (len(PLAINTEXTS), T))
@@ -96,53 +149,28 @@ def getSelectionVectors(PLAINTEXTS, T, mode='list', bytePositions=(0,1,2,3,4,5,6
 
     print("generating selection vectors:", mode)
 
-    if mode=='list':
-        for keyByteGuess in range(256):
-            vectPos=[]
-            for bytePosition in range(16):
-                vectTrace=[]
-                for traceNumber in range(T):
-                    vectTrace.append(selectionFunction(PLAINTEXTS[traceNumber][bytePosition], keyByteGuess, mask=masks[-1]))
-                vectPos.append(vectTrace)
-            SELECTIONVECTORS.append(vectPos)
-        return(SELECTIONVECTORS)
-
-    elif mode=='vect':
+    if mode=='list' or mode=='vect':
+        PLAINTEXTS = plaintextArray(PLAINTEXTS, T)
+        #SELECTIONVECTORS[keyByteGuess][bytePosition] with the last mask
+        bits = np.stack([selectionBits(PLAINTEXTS[:, bytePosition], masks[-1:])[:, 0] for bytePosition in range(16)], axis=1)
+        if mode=='list':
+            return(bits.tolist())
         VS=VectorSpace(GF(2), T)
-        for keyByteGuess in range(256):
-            vectPos=[]
-            for bytePosition in range(16):
-                vectTrace=[]
-                for traceNumber in range(T):
-                    vectTrace.append(selectionFunction(PLAINTEXTS[traceNumber][bytePosition], keyByteGuess, mask=masks[-1]))
-                vectPos.append(VS(vectTrace))
-            SELECTIONVECTORS.append(vectPos)
-        return(SELECTIONVECTORS)
+        return([[VS(vectTrace) for vectTrace in vectPos] for vectPos in bits.tolist()])
 
     elif mode=='mat':
-        bytes_keys = list(itertools.product(bytePositions,list(range(256))))
-        for bytePosition, keyByteGuess in tqdm(bytes_keys):
-            for mask in masks:
-                selVect=[]
-                for traceNumber in range(T):
-                    selVect.append(selectionFunction(PLAINTEXTS[traceNumber][bytePosition], keyByteGuess, mask=mask))
-                SELECTIONVECTORS.append(Matrix(GF(2), 1, len(selVect), selVect))
-                INFO.append((bytePosition, keyByteGuess, mask))
-        return SELECTIONVECTORS, INFO
+        SELECTIONVECTORS, INFO = packedSelectionVectors(PLAINTEXTS, T, bytePositions, masks, pathToTraces)
+        return [Matrix(GF(2), 1, T, selVect) for selVect in SELECTIONVECTORS.bits().tolist()], INFO
 
     elif mode=='fulmat':
-        bytes_keys = list(itertools.product(bytePositions,list(range(256))))
-        for bytePosition, keyByteGuess in tqdm(bytes_keys):
-            for mask in masks:
-                selVect=[]
-                for traceNumber in range(T):
-                    selVect.append(selectionFunction(PLAINTEXTS[traceNumber][bytePosition], keyByteGuess, mask=mask))
-                SELECTIONVECTORS.append(selVect)
-                INFO.append((bytePosition, keyByteGuess, mask))
-        return Matrix(GF(2),SELECTIONVECTORS), INFO
+        SELECTIONVECTORS, INFO = packedSelectionVectors(PLAINTEXTS, T, bytePositions, masks, pathToTraces)
+        return SELECTIONVECTORS.toSage(), INFO
+
+    elif mode=='packed':
+        return packedSelectionVectors(PLAINTEXTS, T, bytePositions, masks, pathToTraces)
 
     print("Unrecognized mode for the getSelectionVectors function")
-    print("Existing modes are 'list', 'vect', 'mat' and 'fulmat'")
+    print("Existing modes are 'list', 'vect', 'mat', 'fulmat' and 'packed'")
     print("Exiting the program.")
     exit()
 
@@ -161,6 +189,29 @@ LINEAR_MAPS = [
     for mask in range(256)
 ]
 
+#Single-bit masks: as LINEAR_MAPS is linear in the mask, the selection bits of
+#any mask are the XOR of the selection bits of its single bits
+BIT_MASKS = [1 << i for i in range(8)]
+
+#Given parities of selection vectors (a Sage matrix whose columns are ordered
+#as the selection vectors of the BIT_MASKS, i.e. 8 columns per byte position
+#and key guess), returns a (byte position, key guess) x len(masks) boolean
+#array telling which parities of the given masks are zero. The parity of each
+#mask is derived by XORing the columns of its bits.
+def zeroMaskParities(selParities, masks):
+    bits = np.asarray(selParities.numpy(dtype=np.uint8)).reshape(selParities.nrows(), selParities.ncols()//len(BIT_MASKS), len(BIT_MASKS))
+    columns = np.packbits(bits.transpose(1, 2, 0), axis=-1)
+    parities = np.zeros((256,) + columns[:, 0].shape, dtype=np.uint8)
+    for mask in range(1, 256):
+        lowBit = mask & -mask
+        parities[mask] = parities[mask ^ lowBit] ^ columns[:, lowBit.bit_length()-1]
+    return ~parities[np.asarray(masks, dtype=np.int64)].any(axis=-1).T
+
+#Lookup tables of selectionBits
+SBOX_ARRAY = np.array(AESSBox, dtype=np.uint8)
+LINEAR_MAPS_ARRAY = np.array(LINEAR_MAPS, dtype=np.uint8)
+KEY_GUESSES = np.arange(256, dtype=np.uint8)
+
 def reportKeyMatch(info, **extra):
     bytePosition, keyByteGuess, mask = info
     extra = " ".join(f"{k}={v}" for k, v in extra.items())
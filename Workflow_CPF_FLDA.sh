@@ -64,7 +64,7 @@ if [[ "$DO_LDA" == "1" ]]; then
 	for BYTEPOS in "${BYTEPOSE_LIST[@]}"; do
 		SUB=$(printf "byte%02x" "$BYTEPOS")
 		# CPF-LDA Step 2: RNR extract random trace
-		time sage relationsExtract.py "$TRACES_RAND/$NAME/" "$TRACES_RAND/$NAME.cpf.$SUB/" "$TRACES_BASE/$NAME.$SUB"/RNrel_W*.pkl "$bigNRN"
+		time sage relationsExtract.py "$TRACES_RAND/$NAME/" "$TRACES_RAND/$NAME.cpf.$SUB/" "$TRACES_BASE/$NAME.$SUB"/RNrel_W*.rel "$bigNRN"
 
 		set +x
 		cp "$TRACES_RAND/$NAME/"*.pt "$TRACES_RAND/$NAME.cpf.$SUB/"
@@ -84,12 +84,12 @@ if [[ "$DO_FLDA" == "1" ]]; then
 		SUB=$(printf "byte%02x" "$BYTEPOS")
 		
 		# CPF-FLDA Step 2: record redundant relations on fixed traces (to use later)
-		pattern="$TRACES_RAND/$NAME/"FRNrel_W*.pkl.gz 
+		pattern="$TRACES_RAND/$NAME/"FRNrel_W*.rel 
 		randFRNR=( $pattern )
 		$TIME sage FRNR.py $FRNR_FLAGS "$TRACES_BASE/$NAME.$SUB/" --save-relations --baseNRNpath="$TRACES_RAND/$NAME/" --skip-relations="${randFRNR[-1]}" -W "$WINDOW"
 		
 		# CPF-FLDA Step 3: use redundant relations from fixed traces on random traces
-		pattern="$TRACES_BASE/$NAME.$SUB/"FRNrel_W*.pkl.gz
+		pattern="$TRACES_BASE/$NAME.$SUB/"FRNrel_W*.rel
 		fixedFRNR=( $pattern )
 		$TIME sage FLDA-by-pos.py $FRNR_FLAGS "$TRACES_RAND/$NAME/" --frnr="${fixedFRNR[-1]}" --byte="$BYTEPOS" --masks="$MASKS" -s="$STOP_ON_KEY_MATCH" -W "$WINDOW"
 	done
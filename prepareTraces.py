@@ -27,6 +27,11 @@ parser.add_argument(
     help="Number of nodes to slide after resolving a window for Redundant Node Removal"
 )
 
+parser.add_argument(
+    '--tune', type=int, nargs=2, default=None, metavar=('WMIN', 'WMAX'),
+    help="Choose W and S between these window sizes from the removal rate on the first nodes (-W and -S are ignored)"
+)
+
 parser.add_argument(
     '-t', '--falsePos', type=int, default=30,
     help="Exceding number of traces to avoid false-positives"
@@ -34,7 +39,7 @@ parser.add_argument(
 
 parser.add_argument(
     '--save-relations', action='store_true',
-    help="Save redundant relations in a pickle file",
+    help="Save redundant relations in a relation store RNrel_Wx.rel",
 )
 
 parser.add_argument(
@@ -42,23 +47,34 @@ parser.add_argument(
     help="Do not remove affine redundancies"
 )
 
+parser.add_argument(
+    '-m', '--memory', type=int, default=None,
+    help="Transpose the traces by tiles using about this much memory (in MB) instead of loading them all"
+)
+
+parser.add_argument(
+    '--format', type=int, default=1, choices=(1, 2),
+    help="Version of nodeVectors.bin: 2 has 64-bit aligned rows and an index section"
+)
+
+parser.add_argument(
+    '-j', '--jobs', type=int, default=1,
+    help="Number of processes transposing the node vectors, and removing the redundant nodes, in parallel"
+)
+
+parser.add_argument(
+    '--dedup', action='store_true',
+    help="Build an index of the constant, duplicate and complemented node vectors, skipped by RNR"
+)
+
 args = parser.parse_args()
 
 for trace_dir in args.trace_dirs:
     print("Processing trace folder", trace_dir)
-    transposeTraces(trace_dir)
+    transposeTraces(trace_dir, memoryLimit=args.memory, version=args.format, jobs=args.jobs, dedup=args.dedup)
     print()
 
-    try:
-        RNR(trace_dir, args.Window, args.Sliding, args.falsePos, save_relations=args.save_relations)
-    except Exception as err:
-        print("Error:", err)
-        print("The file \"nodeVectors.bin\" is corrupted, most likely because the program has been")
-        print("interrupted when creating it.")
-        print("Removing it and recreating a new one...")
-        #If transposeTraces is interrupted halfway through computation, an unfinished
-        #nodeVectors.bin file can be created and won't work. This excpetion resolves
-        #this problem.
-        os.remove(trace_dir / "nodeVectors.bin")
-        transposeTraces(trace_dir)
-        RNR(trace_dir, args.Window, args.Sliding, args.falsePos, affine=not args.no_affine)
+    #transposeTraces writes nodeVectors.bin under a temporary name and renames it
+    #once complete, so an interrupted preparation never leaves a partial file:
+    #relaunching it resumes the transposition from its last checkpoint.
+    RNR(trace_dir, args.Window, args.Sliding, args.falsePos, save_relations=args.save_relations, affine=not args.no_affine, jobs=args.jobs, tune=args.tune)
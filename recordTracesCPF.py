@@ -12,10 +12,14 @@ from wboxkit.fastcircuit import FastCircuit, chunks
 from wboxkit.tracing import trace_split_batch
 from wboxkit.attacks.reader import Reader
 
+from transposeTraces import mergeTiles, nodeVectorsFiles
+
 PATH_FORMAT_TRACE = "%04d.bin"
 PATH_FORMAT_TMP = ".chunk%04d.bin"
 PATH_FORMAT_PT = "%04d.pt"
 PATH_FORMAT_CT = "%04d.ct"
+PATH_PLAINTEXTS = "plaintexts.bin"
+PATH_CIPHERTEXTS = "ciphertexts.bin"
 
 
 def main():
@@ -61,6 +65,22 @@ and an extra `epsilon` fully random traces.
         help="seed to generate plaintexts"
     )
 
+    parser.add_argument(
+        '--direct', action='store_true',
+        help=(
+            "write the batches straight into nodeVectors.bin, and the plaintexts/ciphertexts"
+            " into plaintexts.bin/ciphertexts.bin, instead of one file per trace"
+        )
+    )
+    parser.add_argument(
+        '-m', '--memory', type=int, default=1024,
+        help="memory (in MB) used to merge the batches into nodeVectors.bin with --direct"
+    )
+    parser.add_argument(
+        '--format', type=int, default=1, choices=(1, 2),
+        help="version of nodeVectors.bin created with --direct"
+    )
+
 
     args = parser.parse_args()
 
@@ -132,6 +152,25 @@ and an extra `epsilon` fully random traces.
         inputs=pts,
         trace_filename_format=str(PREFIX / PATH_FORMAT_TMP)
     )
+
+    if args.direct:
+        # the batches are already node-major: 8 bytes (64 traces) per node
+        chunks = [(PREFIX / (PATH_FORMAT_TMP % i), 8) for i in range(len(pts)//64)]
+        num_nodes = os.path.getsize(chunks[0][0]) // 8
+        for segment in nodeVectorsFiles(PREFIX)[1:]:
+            os.unlink(segment)
+        print("merging", len(chunks), "batches into nodeVectors.bin")
+        mergeTiles(PREFIX, chunks, (num_nodes + 7) // 8 * 8, len(pts), args.memory, args.format)
+        print()
+        for filename, _ in chunks:
+            os.unlink(filename)
+
+        with open(PREFIX / PATH_PLAINTEXTS, "wb") as f:
+            f.write(b"".join(pts))
+        with open(PREFIX / PATH_CIPHERTEXTS, "wb") as f:
+            f.write(b"".join(cts))
+        return
+
     for i in range((N+63)//64):
         print("splitting", i)
         filename = PREFIX / (PATH_FORMAT_TMP % i)
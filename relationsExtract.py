@@ -5,10 +5,13 @@ import pickle
 import fnmatch
 from time import time
 from tqdm import tqdm
+import numpy as np
 
 from sage.all import Matrix, GF, floor
 
 from transposeTraces import  getHeader, getNodeVectors, writeNodeVectors
+from PackedMatrix import PackedMatrix
+from RelationStore import RelationStore
 
 
 def extract_relations(pathToTraces, dstTraces, relFile, NRNfile):
@@ -17,20 +20,18 @@ def extract_relations(pathToTraces, dstTraces, relFile, NRNfile):
 
     dstTraces.mkdir(exist_ok=True)
 
-    with open(relFile, "rb") as file:
-        relations=pickle.load(file)
+    relations=RelationStore(relFile)
 
     with open(NRNfile, "rb") as file:
         NonRedundantNodes=pickle.load(file)
 
     #NODEVECTORS = getNodeVectors(pathToTraces, T)[0]
-    NODEVECTORS = getNodeVectors(pathToTraces, T, NonRedundantNodes=NonRedundantNodes)[0]
-    NODEVECTORS = dict(zip(NonRedundantNodes, NODEVECTORS))
+    NODEVECTORS = getNodeVectors(pathToTraces, T, NonRedundantNodes=NonRedundantNodes, mode='packed')[0]
+    position = dict(zip(NonRedundantNodes, range(len(NODEVECTORS))))
 
-    OUTPUT = []
-    for rel in tqdm(relations):
-        res = sum(NODEVECTORS[idx] for idx in rel)
-        OUTPUT.append(res)
+    OUTPUT = PackedMatrix.zeros(len(relations), T)
+    for i in tqdm(range(len(relations))):
+        OUTPUT.words[i] = np.bitwise_xor.reduce(NODEVECTORS.words[[position[idx] for idx in relations.nodes(i).tolist()]], axis=0)
 
     print("Writing...")
     writeNodeVectors(OUTPUT, dstTraces / "nodeVectors.bin")
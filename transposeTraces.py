@@ -3,11 +3,68 @@ import pathlib
 import os
 import io
 import sys
+import itertools
+import multiprocessing
+import pickle
+import hashlib
+import json
+import fcntl
 from time import time
 
+try:
+    import numpy as np
+except ImportError:
+    #pypy3 without numpy: the slow bit-by-bit transposition is used instead
+    np = None
+
 TRACE_HEADER = b"WboxTrac"
 TRACE_FOOTER = b"TraceEnd"
 
+#nodeVectors.bin v2: a HEADER_V2_SIZE bytes header (magic, version, numOfNodes,
+#T, row stride, data offset, index offset and size), the rows padded to whole
+#64-bit words, an optional index section of named node lists, and the footer.
+#v1 files (TRACE_HEADER, numOfNodes, T, rows of (T+7)//8 bytes) stay readable.
+TRACE_HEADER_V2 = b"WboxTrcV"
+HEADER_V2_SIZE = 64
+INDEX_NAME_SIZE = 16
+
+#Number of node bytes (8 nodes each) transposed and written at once
+NODE_BLOCK_BYTES = 1 << 12
+
+#Minimal number of seconds between two checkpoints of an unfinished file
+CHECKPOINT_INTERVAL = 30
+
+#Dedup index of the constant, duplicate and complemented node vectors, and
+#number of bytes of node vectors fingerprinted at once to build it
+DEDUP_FILE = "dedup.pkl"
+DEDUP_BLOCK_BYTES = 1 << 26
+FINGERPRINT_PRIME = 0x100000001B3
+
+#Cache of gathered node vectors and generated selection vectors (packed
+#matrices saved as .npy files, mapped back on the next runs) and default size
+#budget of this cache in bytes
+CACHE_DIR = "cache"
+CACHE_BUDGET = 1 << 32
+
+#Number of node vectors loaded ahead of the sliding window by NodeVectorsWindow
+WINDOW_PREFETCH = 1 << 14
+
+#Packed plaintexts and ciphertexts (TEXT_SIZE bytes per trace) written by the
+#preparation, with the text file (SEL) and the per-trace files (BU) they pack
+PLAINTEXTS_FILE = "plaintexts.bin"
+CIPHERTEXTS_FILE = "ciphertexts.bin"
+TEXT_SIZE = 16
+TEXT_SOURCES = {
+    PLAINTEXTS_FILE: ("plaintext.txt", "%04d.pt"),
+    CIPHERTEXTS_FILE: ("ciphertext.txt", "%04d.ct"),
+}
+
+#Manifest of the artifacts derived from the traces (name -> kind, parameters,
+#size and fingerprint of the node vectors they were derived from), and number
+#of bytes of node vectors hashed into this fingerprint
+MANIFEST_FILE = "manifest.json"
+FINGERPRINT_BYTES = 1 << 20
+
 
 def to_bytes(n, length=1, byteorder='big', signed=False):
     if byteorder == 'little':
@@ -19,7 +76,424 @@ def to_bytes(n, length=1, byteorder='big', signed=False):
 
     return bytes((n >> i*8) & 0xff for i in order)
 
-def transposeTraces(pathToTraces):
+
+#Number of bytes of a node vector of T traces in a nodeVectors.bin file
+def rowStride(T, version=1):
+    if version == 1:
+        return (T+7)//8
+    return 8*((T+63)//64)
+
+
+#Pads the rows of a packed uint8 array with zero bytes up to stride bytes
+def padRows(rows, stride):
+    if rows.shape[1] == stride:
+        return rows
+    padded = np.zeros((rows.shape[0], stride), dtype=np.uint8)
+    padded[:, :rows.shape[1]] = rows
+    return padded
+
+
+def writeNodeVectorsHeader(outputfile, numOfNodes, T, version=1, indexOffset=0, indexSize=0):
+    if version == 1:
+        outputfile.write(TRACE_HEADER)
+        outputfile.write(to_bytes(numOfNodes, 4, 'big'))
+        outputfile.write(to_bytes(T, 4, 'big'))
+        return
+    outputfile.write(TRACE_HEADER_V2)
+    outputfile.write(to_bytes(version, 4, 'big'))
+    outputfile.write(to_bytes(numOfNodes, 4, 'big'))
+    outputfile.write(to_bytes(T, 4, 'big'))
+    outputfile.write(to_bytes(rowStride(T, version), 4, 'big'))
+    outputfile.write(to_bytes(HEADER_V2_SIZE, 8, 'big'))
+    outputfile.write(to_bytes(indexOffset, 8, 'big'))
+    outputfile.write(to_bytes(indexSize, 8, 'big'))
+    outputfile.write(bytes(HEADER_V2_SIZE-48))
+
+
+#An unfinished output file fileName (nodeVectors.bin or a segment) is written
+#as fileName.tmp, while fileName.progress records a key describing it (step,
+#format, sizes) and the number of its units (node bytes, nodes or tiles)
+#already written, so that an interrupted preparation resumes from there. The
+#file is renamed to fileName once complete, so fileName is never partial.
+def unfinishedName(fileName, suffix=".tmp"):
+    return fileName.parent / (fileName.name + suffix)
+
+
+#Returns the number of units written according to the checkpoint of fileName
+#(0 if there is none, or if it was written for another key)
+def readCheckpoint(fileName, key):
+    try:
+        with open(unfinishedName(fileName, ".progress"), "rt") as fprogress:
+            savedKey, done = fprogress.read().rsplit(" ", 1)
+        if savedKey != key:
+            return 0
+        return int(done)
+    except (IOError, ValueError):
+        return 0
+
+
+def writeCheckpoint(fileName, key, done):
+    with open(unfinishedName(fileName, ".progress.tmp"), "wt") as fprogress:
+        fprogress.write("%s %d" % (key, done))
+    os.replace(unfinishedName(fileName, ".progress.tmp"), unfinishedName(fileName, ".progress"))
+
+
+#Opens the unfinished file of fileName, resuming it if its checkpoint matches
+#key, and returns it with the number of units already written
+def openUnfinished(fileName, key):
+    done = 0
+    if key is not None and os.path.exists(unfinishedName(fileName)):
+        done = readCheckpoint(fileName, key)
+    if done:
+        print("Resuming the unfinished \"%s\" from its last checkpoint" % fileName.name)
+        return open(unfinishedName(fileName), "r+b"), done
+    return open(unfinishedName(fileName), "wb"), 0
+
+
+#Atomically renames the completed unfinished file of fileName into fileName
+def finishUnfinished(fileName):
+    os.replace(unfinishedName(fileName), fileName)
+    if os.path.exists(unfinishedName(fileName, ".progress")):
+        os.remove(unfinishedName(fileName, ".progress"))
+
+
+#transposeBits transposes a block of K packed traces (a K x numOfBytes uint8
+#array where the node n is the bit 7-n%8 of the byte n//8) into packed node
+#vectors (a 8*numOfBytes x (K+7)//8 uint8 array where the trace i is the bit
+#7-i%8 of the byte i//8), which is the layout of the rows of nodeVectors.bin.
+#Each 8 traces x 8 nodes sub-block is loaded into a 64-bit word and transposed
+#with the three delta swaps of Hacker's Delight (transpose8).
+def transposeBits(traceBytes):
+    K, numOfBytes = traceBytes.shape
+    Kbytes = (K+7)//8
+    if K % 8:
+        padding = np.zeros((8*Kbytes-K, numOfBytes), dtype=np.uint8)
+        traceBytes = np.concatenate((traceBytes, padding))
+
+    #x[g, j]: traces 8g..8g+7 (most significant byte first) of the nodes 8j..8j+7
+    blocks = traceBytes.reshape(Kbytes, 8, numOfBytes).transpose(0, 2, 1)
+    x = np.ascontiguousarray(blocks).view('>u8')[..., 0].astype(np.uint64)
+
+    t = (x ^ (x >> np.uint64(7))) & np.uint64(0x00AA00AA00AA00AA)
+    x ^= t ^ (t << np.uint64(7))
+    t = (x ^ (x >> np.uint64(14))) & np.uint64(0x0000CCCC0000CCCC)
+    x ^= t ^ (t << np.uint64(14))
+    t = (x ^ (x >> np.uint64(28))) & np.uint64(0x00000000F0F0F0F0)
+    x ^= t ^ (t << np.uint64(28))
+
+    #x[g, j] now holds the nodes 8j..8j+7 (most significant byte first) of the traces 8g..8g+7
+    nodeBytes = x.astype('>u8').view(np.uint8).reshape(Kbytes, numOfBytes, 8)
+    return np.ascontiguousarray(nodeBytes.transpose(1, 2, 0)).reshape(8*numOfBytes, Kbytes)
+
+
+#Writes the transposition of the K x numOfBytes packed traces TRACES as the
+#first numOfNodes node vectors of outputfile, by blocks of NODE_BLOCK_BYTES.
+#The rows are padded with zero bytes up to stride bytes if it is given.
+#With jobs > 1, the node blocks are split among jobs worker processes.
+#If checkpoint=(fileName, key) is given, the number of node bytes written is
+#checkpointed, and the first done node bytes are assumed already written.
+def writeTransposedTraces(outputfile, TRACES, numOfNodes, silent=0, stride=None, jobs=1, checkpoint=None, done=0):
+    if jobs > 1:
+        writeTransposedTracesParallel(outputfile, TRACES, numOfNodes, silent, stride, jobs, checkpoint, done)
+        return
+    numOfBytes = (numOfNodes+7)//8
+    width = stride if stride is not None else (len(TRACES)+7)//8
+    outputfile.seek(8*done*width, os.SEEK_CUR)
+    t0 = time()
+    lastCheckpoint = t0
+    for byteBegining in range(done, numOfBytes, NODE_BLOCK_BYTES):
+        byteEnding = min(byteBegining+NODE_BLOCK_BYTES, numOfBytes)
+        nodeVectors = transposeBits(TRACES[:, byteBegining:byteEnding])
+        nodeVectors = nodeVectors[:numOfNodes-8*byteBegining]
+        if stride is not None:
+            nodeVectors = padRows(nodeVectors, stride)
+        outputfile.write(nodeVectors.tobytes())
+        if checkpoint is not None and time()-lastCheckpoint > CHECKPOINT_INTERVAL:
+            outputfile.flush()
+            writeCheckpoint(*checkpoint, byteEnding)
+            lastCheckpoint = time()
+        if not silent:
+            node = 8*byteEnding
+            timeRemaining = (time()-t0)/(byteEnding-done)*(numOfBytes-byteEnding)
+            print("node %d/%d (%.2f%%)," % (min(node, numOfNodes), numOfNodes, 100*min(node, numOfNodes)/numOfNodes), end="")
+            print(" Estimated remaining time: %dh%dm%.2fs                         " % (timeRemaining//3600, (timeRemaining//60)%60, timeRemaining%60), end = "\r")
+
+
+#Packed traces and output file of a worker process of writeTransposedTracesParallel
+workerTraces = None
+workerFile = None
+
+
+def initTransposeWorker(TRACES, fileName):
+    global workerTraces, workerFile
+    workerTraces = TRACES
+    workerFile = open(fileName, "r+b", buffering=0)
+
+
+#Transposes the node bytes byteBegining..byteEnding of the traces of the worker
+#and writes their rows (of width bytes) at their place in the output file
+def transposeNodeBlock(block):
+    byteBegining, byteEnding, numOfNodes, offset, width = block
+    nodeVectors = transposeBits(workerTraces[:, byteBegining:byteEnding])
+    nodeVectors = padRows(nodeVectors[:numOfNodes-8*byteBegining], width)
+    workerFile.seek(offset + 8*byteBegining*width)
+    workerFile.write(nodeVectors.tobytes())
+    return byteBegining, byteEnding
+
+
+#Parallel writeTransposedTraces: the file is extended to its final size, and
+#each worker process transposes node blocks and writes them at their offset.
+#The workers are forked when possible so that they share TRACES without copy.
+#The checkpoint records the node bytes up to the first block not written yet.
+def writeTransposedTracesParallel(outputfile, TRACES, numOfNodes, silent, stride, jobs, checkpoint=None, done=0):
+    numOfBytes = (numOfNodes+7)//8
+    width = stride if stride is not None else (len(TRACES)+7)//8
+    outputfile.flush()
+    offset = outputfile.tell()
+    outputfile.truncate(offset + numOfNodes*width)
+
+    blockBytes = max(1, min(NODE_BLOCK_BYTES, -(-(numOfBytes-done) // (4*jobs))))
+    blocks = [(byteBegining, min(byteBegining+blockBytes, numOfBytes), numOfNodes, offset, width) for byteBegining in range(done, numOfBytes, blockBytes)]
+    blockEndings = {}
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+    t0 = time()
+    lastCheckpoint = t0
+    doneBytes = 0
+    with context.Pool(jobs, initializer=initTransposeWorker, initargs=(TRACES, outputfile.name)) as pool:
+        for byteBegining, byteEnding in pool.imap_unordered(transposeNodeBlock, blocks):
+            doneBytes += byteEnding-byteBegining
+            blockEndings[byteBegining] = byteEnding
+            while done in blockEndings:
+                done = blockEndings.pop(done)
+            if checkpoint is not None and time()-lastCheckpoint > CHECKPOINT_INTERVAL:
+                writeCheckpoint(*checkpoint, done)
+                lastCheckpoint = time()
+            if not silent:
+                node = min(8*done, numOfNodes)
+                timeRemaining = (time()-t0)/doneBytes*(numOfBytes-done)
+                print("node %d/%d (%.2f%%)," % (node, numOfNodes, 100*node/numOfNodes), end="")
+                print(" Estimated remaining time: %dh%dm%.2fs                         " % (timeRemaining//3600, (timeRemaining//60)%60, timeRemaining%60), end = "\r")
+    outputfile.seek(offset + numOfNodes*width)
+
+
+#Packs the lines of a SEL trace.txt file into a T x (numOfNodes+7)//8 uint8 array.
+#firstTrace is the number of the first line, used in the error messages.
+#Returns None if a trace is shorter than the first one.
+def packTracesSEL(lines, numOfNodes, firstTrace=0):
+    TRACES = np.empty((len(lines), (numOfNodes+7)//8), dtype=np.uint8)
+    for traceNumber, line in enumerate(lines, firstTrace):
+        if len(line) < numOfNodes:
+            print("/!\\ The trace %d does not have the size as the first one /!\\" % traceNumber)
+            return None
+        bits = np.frombuffer(line[:numOfNodes].encode(), dtype=np.uint8) - ord('0')
+        if bits.max(initial=0) > 1:
+            raise ValueError("The trace %d contains characters other than 0 and 1" % traceNumber)
+        TRACES[traceNumber-firstTrace] = np.packbits(bits)
+    return TRACES
+
+
+#Returns the number of consecutive BU traces 0000.bin, 0001.bin, ...
+def countTracesBU(pathToTraces):
+    T = 0
+    while os.path.exists(pathToTraces / ("%04d.bin" % T)):
+        T += 1
+    return T
+
+
+#Reads the BU traces begining.bin, ..., (ending-1).bin (by default all of them)
+#into a T x numOfBytes uint8 array.
+#Returns None if a trace does not have the size of the first one.
+def readTracesBU(pathToTraces, numOfBytes, begining=0, ending=None):
+    if ending is None:
+        ending = countTracesBU(pathToTraces)
+    TRACES = np.empty((ending-begining, numOfBytes), dtype=np.uint8)
+    for traceNumber in range(begining, ending):
+        with open(pathToTraces / ("%04d.bin" % traceNumber), "rb") as file:
+            trace = file.read(numOfBytes+1)
+        if len(trace) != numOfBytes:
+            print("/!\\ The trace %04d.bin does not have the size as the trace 0000.bin /!\\" % traceNumber)
+            return None
+        TRACES[traceNumber-begining] = np.frombuffer(trace, dtype=np.uint8)
+    return TRACES
+
+
+#Generators reading the SEL or BU traces by blocks of K packed traces,
+#starting from the trace begining
+def iterTracesSEL(pathToTraces, numOfNodes, K, begining=0):
+    with open(pathToTraces / "trace.txt", "rt") as ftxt:
+        firstTrace = begining
+        traceLines = itertools.islice(ftxt, begining, None)
+        while True:
+            lines = list(itertools.islice(traceLines, K))
+            if not lines:
+                return
+            TRACES = packTracesSEL(lines, numOfNodes, firstTrace)
+            if TRACES is None:
+                print("Exiting the program.")
+                sys.exit()
+            yield TRACES
+            firstTrace += len(lines)
+
+
+def iterTracesBU(pathToTraces, numOfBytes, K, begining=0):
+    T = countTracesBU(pathToTraces)
+    for firstTrace in range(begining, T, K):
+        TRACES = readTracesBU(pathToTraces, numOfBytes, firstTrace, min(firstTrace+K, T))
+        if TRACES is None:
+            print("Exiting the program.")
+            sys.exit()
+        yield TRACES
+
+
+#Number of traces per tile so that a block of packed traces and its
+#transposition temporaries fit in memoryLimit MB (at least 8, multiple of 8)
+def tileSize(numOfBytes, memoryLimit):
+    K = (memoryLimit << 20) // (4*numOfBytes)
+    return max(8, K - K % 8)
+
+
+#Bounded-memory transposition: each block of traces given by traceBlocks
+#(all of them of a size multiple of 8, except the last one) is transposed into
+#a temporary node-major tile file, then the tiles are merged node block by node
+#block into nodeVectors.bin (or outputName), holding about memoryLimit MB at most.
+#Both steps are checkpointed: the tiles are kept until the merge is complete.
+#The tiles of a checkpoint are only reused for the same numOfTraces traces to
+#transpose, by blocks of K traces.
+def transposeTracesByTiles(pathToTraces, traceBlocks, numOfNodes, memoryLimit, version=1, outputName="nodeVectors.bin", jobs=1, numOfTraces=0, K=0):
+    tiles = []
+    tilesName = pathToTraces / ".nodeVectors.tiles"
+    tilesKey = "tiles %s %d %d %d %d" % (outputName, numOfNodes, memoryLimit, numOfTraces, K)
+    tilesDone = readCheckpoint(tilesName, tilesKey)
+    T = 0
+    for TRACES in traceBlocks:
+        ftile = pathToTraces / (".nodeVectors.tile%04d.bin" % len(tiles))
+        if len(tiles) >= tilesDone or not os.path.exists(ftile):
+            with open(ftile, "wb") as tilefile:
+                writeTransposedTraces(tilefile, TRACES, numOfNodes, silent=1, jobs=jobs)
+            tilesDone = len(tiles)+1
+            writeCheckpoint(tilesName, tilesKey, tilesDone)
+        tiles.append((ftile, (len(TRACES)+7)//8))
+        T += len(TRACES)
+        print("Transposed %d traces into %d tiles" % (T, len(tiles)), end="\r")
+    print()
+
+    mergeTiles(pathToTraces, tiles, numOfNodes, T, memoryLimit, version, outputName)
+
+    for ftile, _ in tiles:
+        os.remove(ftile)
+    os.remove(unfinishedName(tilesName, ".progress"))
+
+
+#Merges the node-major tiles (a list of (file, bytes per node) pairs, holding
+#the node vectors of consecutive blocks of traces, T traces in total) node
+#block by node block into nodeVectors.bin (or outputName), holding about
+#memoryLimit MB at most. The nodes missing at the end of a tile are zeros.
+def mergeTiles(pathToTraces, tiles, numOfNodes, T, memoryLimit, version=1, outputName="nodeVectors.bin"):
+    stride = rowStride(T, version)
+    nodesPerBlock = max(1, (memoryLimit << 20) // (2*stride))
+    outputFile = pathToTraces / outputName
+    mergeKey = "merge %d %d %d %d" % (version, numOfNodes, T, len(tiles))
+    outputfile, done = openUnfinished(outputFile, mergeKey)
+    with outputfile:
+        writeNodeVectorsHeader(outputfile, numOfNodes, T, version)
+        outputfile.seek(done*stride, os.SEEK_CUR)
+        lastCheckpoint = time()
+        for nodeBegining in range(done, numOfNodes, nodesPerBlock):
+            nodeEnding = min(nodeBegining+nodesPerBlock, numOfNodes)
+            rows = np.zeros((nodeEnding-nodeBegining, stride), dtype=np.uint8)
+            column = 0
+            for ftile, Kbytes in tiles:
+                with open(ftile, "rb") as tilefile:
+                    tilefile.seek(nodeBegining*Kbytes)
+                    tileBytes = tilefile.read((nodeEnding-nodeBegining)*Kbytes)
+                tileRows = np.frombuffer(tileBytes, dtype=np.uint8).reshape(-1, Kbytes)
+                rows[:len(tileRows), column:column+Kbytes] = tileRows
+                column += Kbytes
+            outputfile.write(rows.tobytes())
+            if time()-lastCheckpoint > CHECKPOINT_INTERVAL:
+                outputfile.flush()
+                writeCheckpoint(outputFile, mergeKey, nodeEnding)
+                lastCheckpoint = time()
+            print("Merging tiles: node %d/%d (%.2f%%)" % (nodeEnding, numOfNodes, 100*nodeEnding/numOfNodes), end="\r")
+        outputfile.write(TRACE_FOOTER)
+    finishUnfinished(outputFile)
+
+
+#Returns the files of the trace segments of pathToTraces: nodeVectors.bin, then
+#nodeVectors.seg0001.bin, nodeVectors.seg0002.bin... holding the next traces
+def nodeVectorsFiles(pathToTraces):
+    files=[pathToTraces / "nodeVectors.bin"]
+    while os.path.exists(pathToTraces / ("nodeVectors.seg%04d.bin" % len(files))):
+        files.append(pathToTraces / ("nodeVectors.seg%04d.bin" % len(files)))
+    return files
+
+
+#Transposes the traces recorded after the creation of nodeVectors.bin (and of
+#its segments) into a new segment, so that growing T only costs the
+#transposition of the new traces.
+def appendTraces(pathToTraces, memoryLimit=None, jobs=1):
+    (numOfNodes, T)=getHeader(pathToTraces)
+    files=nodeVectorsFiles(pathToTraces)
+    version=readNodeVectorsHeader(files[0])[0]
+    SEL=os.path.exists(pathToTraces / "trace.txt")
+    if SEL:
+        with open(pathToTraces / "trace.txt", "rt") as ftxt:
+            newT=sum(1 for line in ftxt)-T
+        numOfBytes=(numOfNodes+7)//8
+    else:
+        newT=countTracesBU(pathToTraces)-T
+        numOfBytes=numOfNodes//8
+    if newT <= 0:
+        return
+    if np is None:
+        print("%d new traces were found, numpy is required to append them to \"nodeVectors.bin\"." % newT)
+        return
+
+    segmentName="nodeVectors.seg%04d.bin" % len(files)
+    print("Transposing the %d new traces into \"%s\"..." % (newT, segmentName))
+    try:
+        if memoryLimit is None:
+            K=newT
+        else:
+            K=tileSize(numOfBytes, memoryLimit)
+        if SEL:
+            traceBlocks=iterTracesSEL(pathToTraces, numOfNodes, K, begining=T)
+        else:
+            traceBlocks=iterTracesBU(pathToTraces, numOfBytes, K, begining=T)
+        if memoryLimit is None:
+            TRACES=next(traceBlocks)
+            outputName=pathToTraces / segmentName
+            key="nodes %d %d %d" % (version, numOfNodes, newT)
+            outputfile, done=openUnfinished(outputName, key)
+            with outputfile:
+                writeNodeVectorsHeader(outputfile, numOfNodes, newT, version)
+                writeTransposedTraces(outputfile, TRACES, numOfNodes, stride=rowStride(newT, version), jobs=jobs, checkpoint=(outputName, key), done=done)
+                outputfile.write(TRACE_FOOTER)
+            finishUnfinished(outputName)
+        else:
+            transposeTracesByTiles(pathToTraces, traceBlocks, numOfNodes, memoryLimit, version, segmentName, jobs, numOfTraces=newT, K=K)
+    except Exception as err:
+        #The unfinished segment and its checkpoint are kept to resume the transposition
+        print(err)
+        print("Relaunch the program to resume the transposition from its last checkpoint.")
+        sys.exit()
+    print()
+    print("The file \"%s\" containing the node vectors of the traces %d to %d has been created." % (segmentName, T, T+newT-1))
+    recordArtifact(pathToTraces, segmentName, "segment", firstTrace=T, T=newT)
+
+
+#Transposes the traces of pathToTraces into nodeVectors.bin. If memoryLimit
+#(in MB) is given, the traces are streamed by tiles instead of being all loaded.
+#version selects the format of nodeVectors.bin (1 or 2). If nodeVectors.bin
+#already exists, the traces recorded since are appended as a new segment.
+#jobs is the number of processes transposing the node vectors in parallel.
+#With dedup=True, the dedup index of the node vectors is built as well.
+#The plaintexts and ciphertexts are packed into plaintexts.bin and
+#ciphertexts.bin.
+def transposeTraces(pathToTraces, memoryLimit=None, version=1, jobs=1, dedup=False):
     try:
         open(pathToTraces / "nodeVectors.bin", "rb")
         print("The traces are already transposed and contained in the file \"nodeVectors.bin\".")
@@ -27,7 +501,8 @@ def transposeTraces(pathToTraces):
         #OPENING TRACE FILE(S) FROM EITHER BU OR SEL  OFFICIAL IMPLEMENTATIONS
         SELorBU=0 #SEL traces = 1, BU traces = 2, not found = 0
         try:
-            f = open(pathToTraces / "trace.txt", "rt").readlines()
+            with open(pathToTraces / "trace.txt", "rt") as ftxt:
+                numOfNodes=len(ftxt.readline())-1
             SELorBU=1
         except IOError:
             pass
@@ -46,122 +521,166 @@ def transposeTraces(pathToTraces):
             print("  Either the path is not correct, or the traces are not in the correct format")
             sys.exit()
 
+        #Segments left over from a previous nodeVectors.bin would follow the new one
+        for segment in nodeVectorsFiles(pathToTraces)[1:]:
+            os.remove(segment)
+
         #READING TRACE FILE(S), TRANSPOSING THEM AND WRITING THEM INTO nodeVectors.bin
         try:
+            #Streaming the traces by tiles
+            if memoryLimit is not None and np is not None:
+                if SELorBU==1:
+                    K=tileSize((numOfNodes+7)//8, memoryLimit)
+                    with open(pathToTraces / "trace.txt", "rt") as ftxt:
+                        T=sum(1 for line in ftxt)
+                    traceBlocks=iterTracesSEL(pathToTraces, numOfNodes, K)
+                else:
+                    numOfNodes=numOfBytes*8
+                    K=tileSize(numOfBytes, memoryLimit)
+                    T=countTracesBU(pathToTraces)
+                    traceBlocks=iterTracesBU(pathToTraces, numOfBytes, K)
+                print("Transposing traces by tiles of %d traces..." % K)
+                transposeTracesByTiles(pathToTraces, traceBlocks, numOfNodes, memoryLimit, version, jobs=jobs, numOfTraces=T, K=K)
             #Processing SEL traces
-            if SELorBU==1:
+            elif SELorBU==1:
                 print()
                 print()
-                with open(pathToTraces / "nodeVectors.bin", "wb") as outputfile:
-                    numOfNodes=len(f[0])-1
-                    T=len(f)
+                f=open(pathToTraces / "trace.txt", "rt").readlines()
+                T=len(f)
+                if np is not None:
+                    TRACES=packTracesSEL(f, numOfNodes)
+                    if TRACES is None:
+                        print("Exiting the program.")
+                        sys.exit()
+                outputName=pathToTraces / "nodeVectors.bin"
+                key="nodes %d %d %d" % (version, numOfNodes, T)
+                outputfile, done=openUnfinished(outputName, key if np is not None else None)
+                with outputfile:
 
                     #WRITING HEADER
-                    outputfile.write(TRACE_HEADER)
-                    outputfile.write(to_bytes(numOfNodes, 4, 'big'))
-                    outputfile.write(to_bytes(T, 4, 'big'))
-
-                    #WRITING NODE VECTORS
-                    for node in range(numOfNodes):
-                        nodeByte=0
-                        for traceNumber in range(T):
-                            try:
-                                nodeByte^=int(f[traceNumber][node]) << (7-traceNumber%8)
-                                if traceNumber%8==7:
+                    writeNodeVectorsHeader(outputfile, numOfNodes, T, version)
+                    padding=bytes(rowStride(T, version)-(T+7)//8)
+
+                    if np is not None:
+                        writeTransposedTraces(outputfile, TRACES, numOfNodes, stride=rowStride(T, version), jobs=jobs, checkpoint=(outputName, key), done=done)
+                    else:
+                        #WRITING NODE VECTORS
+                        for node in range(numOfNodes):
+                            nodeByte=0
+                            for traceNumber in range(T):
+                                try:
+                                    nodeByte^=int(f[traceNumber][node]) << (7-traceNumber%8)
+                                    if traceNumber%8==7:
+                                        outputfile.write(to_bytes(nodeByte, 1, 'big'))
+                                        nodeByte=0
+                                except IndexError:
+                                    print('\033[1A', end='\x1b[2K')
+                                    print("/!\\ The trace %d does not have the size as the first one /!\\" % traceNumber)
+                                    print("Exiting the program.")
+                                    print("The file \"nodeVectors.txt\" has still been created for the first %d nodes (%.2f%%)" % (node,100*node/numOfNodes))
+                                    sys.exit()
+                            if T % 8:
+                                try:
                                     outputfile.write(to_bytes(nodeByte, 1, 'big'))
-                                    nodeByte=0
-                            except IndexError:
-                                print('\033[1A', end='\x1b[2K')
-                                print("/!\\ The trace %d does not have the size as the first one /!\\" % traceNumber)
-                                print("Exiting the program.")
-                                print("The file \"nodeVectors.txt\" has still been created for the first %d nodes (%.2f%%)" % (node,100*node/numOfNodes))
-                                sys.exit()
-                        if T % 8:
-                            try:
-                                outputfile.write(to_bytes(nodeByte, 1, 'big'))
-                            except IndexError:
+                                except IndexError:
+                                    print('\033[1A', end='\x1b[2K')
+                                    print("/!\\ The trace %d does not have the size as the first one /!\\" % traceNumber)
+                                    print("Exiting the program.")
+                                    print("The file \"nodeVectors.txt\" has still been created for the first %d nodes (%.2f%%)" % (node,100*node/numOfNodes))
+                                    sys.exit()
+                            outputfile.write(padding)
+                            if node % 128==0:
                                 print('\033[1A', end='\x1b[2K')
-                                print("/!\\ The trace %d does not have the size as the first one /!\\" % traceNumber)
-                                print("Exiting the program.")
-                                print("The file \"nodeVectors.txt\" has still been created for the first %d nodes (%.2f%%)" % (node,100*node/numOfNodes))
-                                sys.exit()
-                        if node % 128==0:
-                            print('\033[1A', end='\x1b[2K')
-                            print("%d/%d (%.2f%%)" % (node, numOfNodes, 100*node/numOfNodes))
+                                print("%d/%d (%.2f%%)" % (node, numOfNodes, 100*node/numOfNodes))
                     outputfile.write(TRACE_FOOTER)
+                finishUnfinished(outputName)
                 print('\033[1A', end='\x1b[2K')
                 print('\033[1A', end='\x1b[2K')
                 print("The file \"nodeVectors.bin\" containing all the node vectors has been created.")
             else:
                 #Processing BU traces
                 numOfNodes = numOfBytes*8
-                TRACES=[]
-                T = 0
-                while True:
-                    ftrace = pathToTraces / ("%04d.bin" % T)
-                    try:
-                        with open(ftrace, "rb") as file:
-                            try:
-                                TRACES.append(file.read(numOfBytes))
-                            except IOError as err:
-                                print("/!\\ The trace %04d.bin does not have the size as the trace 0000.bin /!\\" % len(TRACES))
-                                print("Exiting the program.")
-                                sys.exit()
-                            if len(TRACES[-1]) != numOfBytes:
-                                print("/!\\ The trace %04d.bin does not have the size as the trace 0000.bin /!\\" % len(TRACES))
-                                print("Exiting the program.")
-                                sys.exit()
-                        T+=1
-                        file.close()
-                    except IOError as err:
-                        break
+                if np is not None:
+                    TRACES=readTracesBU(pathToTraces, numOfBytes)
+                    if TRACES is None:
+                        print("Exiting the program.")
+                        sys.exit()
+                    T=len(TRACES)
+                else:
+                    TRACES=[]
+                    T = 0
+                    while True:
+                        ftrace = pathToTraces / ("%04d.bin" % T)
+                        try:
+                            with open(ftrace, "rb") as file:
+                                try:
+                                    TRACES.append(file.read(numOfBytes))
+                                except IOError as err:
+                                    print("/!\\ The trace %04d.bin does not have the size as the trace 0000.bin /!\\" % len(TRACES))
+                                    print("Exiting the program.")
+                                    sys.exit()
+                                if len(TRACES[-1]) != numOfBytes:
+                                    print("/!\\ The trace %04d.bin does not have the size as the trace 0000.bin /!\\" % len(TRACES))
+                                    print("Exiting the program.")
+                                    sys.exit()
+                            T+=1
+                            file.close()
+                        except IOError as err:
+                            break
                 #TRANSPOSITION OF TRACES AND WRITING THE NODE VECTORS
                 print("Transposing traces...")
-                with open(pathToTraces / "nodeVectors.bin", "wb") as outputfile:
+                outputName=pathToTraces / "nodeVectors.bin"
+                key="nodes %d %d %d" % (version, numOfNodes, T)
+                outputfile, done=openUnfinished(outputName, key if np is not None else None)
+                with outputfile:
 
                     #WRITING HEADER
-                    outputfile.write(TRACE_HEADER)
-                    outputfile.write(to_bytes(numOfNodes, 4, 'big'))
-                    outputfile.write(to_bytes(T, 4, 'big'))
-
-                    #WRITING NODE VECTORS
-                    SUMtime=0
-                    numberOfTimes=0
-                    for node in range(numOfNodes):
-                        t1=time()
-                        nodeByte=0
-                        for traceNumber in range(T):
-                            try:
-                                nodeByte ^= ((TRACES[traceNumber][node//8] >> (7-node%8)) & 1) << (7-traceNumber%8)
-                                if traceNumber%8==7:
+                    writeNodeVectorsHeader(outputfile, numOfNodes, T, version)
+                    padding=bytes(rowStride(T, version)-(T+7)//8)
+
+                    if np is not None:
+                        writeTransposedTraces(outputfile, TRACES, numOfNodes, stride=rowStride(T, version), jobs=jobs, checkpoint=(outputName, key), done=done)
+                    else:
+                        #WRITING NODE VECTORS
+                        SUMtime=0
+                        numberOfTimes=0
+                        for node in range(numOfNodes):
+                            t1=time()
+                            nodeByte=0
+                            for traceNumber in range(T):
+                                try:
+                                    nodeByte ^= ((TRACES[traceNumber][node//8] >> (7-node%8)) & 1) << (7-traceNumber%8)
+                                    if traceNumber%8==7:
+                                        outputfile.write(to_bytes(nodeByte, 1, 'big'))
+                                        nodeByte=0
+                                except IndexError:
+                                    print('\033[1A', end='\x1b[2K')
+                                    print("/!\\ The trace %04d.bin does not have the size as the the trace 0000.bin /!\\" % traceNumber)
+                                    print("Exiting the program.")
+                                    print("The file \"nodeVectors.txt\" has still been created for the first %d nodes (%.2f%%)" % (node,100*node/numOfNodes))
+                                    sys.exit()
+                            if T % 8:
+                                try:
                                     outputfile.write(to_bytes(nodeByte, 1, 'big'))
-                                    nodeByte=0
-                            except IndexError:
-                                print('\033[1A', end='\x1b[2K')
-                                print("/!\\ The trace %04d.bin does not have the size as the the trace 0000.bin /!\\" % traceNumber)
-                                print("Exiting the program.")
-                                print("The file \"nodeVectors.txt\" has still been created for the first %d nodes (%.2f%%)" % (node,100*node/numOfNodes))
-                                sys.exit()
-                        if T % 8:
-                            try:
-                                outputfile.write(to_bytes(nodeByte, 1, 'big'))
-                            except IndexError:
-                                print('\033[1A', end='\x1b[2K')
-                                print("/!\\ The trace %04d.bin does not have the size as the the trace 0000.bin /!\\" % traceNumber)
-                                print("Exiting the program.")
-                                print("The file \"nodeVectors.txt\" has still been created for the first %d nodes (%.2f%%)" % (node,100*node/numOfNodes))
-                                sys.exit()
-                        t2=time()
-                        SUMtime+=t2-t1
-                        if node % 128==0:
-                            print("node %d/%d (%.2f%%)," % (node, numOfNodes, 100*node/numOfNodes), end="")
-                            timeRemaining=SUMtime/(node+1)*(numOfNodes-node)
-                            print(" Estimated remaining time: %dh%dm%.2fs                         " % (timeRemaining//3600, (timeRemaining//60)%60, timeRemaining%60), end = "\r")
+                                except IndexError:
+                                    print('\033[1A', end='\x1b[2K')
+                                    print("/!\\ The trace %04d.bin does not have the size as the the trace 0000.bin /!\\" % traceNumber)
+                                    print("Exiting the program.")
+                                    print("The file \"nodeVectors.txt\" has still been created for the first %d nodes (%.2f%%)" % (node,100*node/numOfNodes))
+                                    sys.exit()
+                            outputfile.write(padding)
+                            t2=time()
+                            SUMtime+=t2-t1
+                            if node % 128==0:
+                                print("node %d/%d (%.2f%%)," % (node, numOfNodes, 100*node/numOfNodes), end="")
+                                timeRemaining=SUMtime/(node+1)*(numOfNodes-node)
+                                print(" Estimated remaining time: %dh%dm%.2fs                         " % (timeRemaining//3600, (timeRemaining//60)%60, timeRemaining%60), end = "\r")
                     outputfile.write(TRACE_FOOTER)
+                finishUnfinished(outputName)
         except Exception as err:
-            if os.path.exists(pathToTraces / "nodeVectors.bin"):
-                os.remove(pathToTraces / "nodeVectors.bin")
+            #The unfinished file and its checkpoint are kept to resume the transposition
             print(err)
+            print("Relaunch the program to resume the transposition from its last checkpoint.")
             sys.exit()
         print()
         print("                                                                          ", end="\r")
@@ -169,15 +688,117 @@ def transposeTraces(pathToTraces):
         print("                                                                          ", end="\r")
         print('\033[1A', end='\x1b[2K')
         print("The file \"nodeVectors.bin\" containing all the node vectors has been created.")
+        recordNodeVectors(pathToTraces)
+    else:
+        appendTraces(pathToTraces, memoryLimit, jobs)
+
+    for name in (PLAINTEXTS_FILE, CIPHERTEXTS_FILE):
+        packTexts(pathToTraces, name)
 
+    if dedup and np is not None and readDedupIndex(pathToTraces) is None:
+        buildDedupIndex(pathToTraces)
+
+
+#Tells whether the packed texts file name (PLAINTEXTS_FILE or CIPHERTEXTS_FILE)
+#of pathToTraces holds all the texts of the SEL text file or BU per-trace files.
+#Without any of them (e.g. traces recorded by recordTracesCPF.py --direct), the
+#packed file is the only source and is up to date.
+def packedTextsUpToDate(pathToTraces, name):
+    (textName, fileFormat)=TEXT_SOURCES[name]
+    packedName=pathToTraces / name
+    if not os.path.exists(packedName):
+        return False
+    if os.path.exists(pathToTraces / textName):
+        return os.path.getmtime(pathToTraces / textName) <= os.path.getmtime(packedName)
+    if not os.path.exists(pathToTraces / (fileFormat % 0)):
+        return True
+    #BU: the number of per-trace files and the newest of their modification
+    #times are recorded when they are packed. The traces being recorded in
+    #order, only the first and last files are checked against them, so that
+    #the texts are not checked trace by trace.
+    entry=readManifest(pathToTraces).get(name)
+    if entry is None or "sourcesTime" not in entry:
+        return False
+    count=entry["T"]
+    if os.path.getsize(packedName) != count*TEXT_SIZE or os.path.exists(pathToTraces / (fileFormat % count)):
+        return False
+    try:
+        return all(os.path.getmtime(pathToTraces / (fileFormat % i)) <= entry["sourcesTime"] for i in (0, count-1))
+    except OSError:
+        return False
 
+
+#Packs the texts of the SEL text file or of the BU per-trace files into the
+#file name (PLAINTEXTS_FILE or CIPHERTEXTS_FILE), unless it is up to date.
+#Nothing is written if the texts are missing, not all of TEXT_SIZE bytes or
+#not bytes, the texts being then read from their files.
+def packTexts(pathToTraces, name):
+    if packedTextsUpToDate(pathToTraces, name):
+        return
+    (textName, fileFormat)=TEXT_SOURCES[name]
+    records=[]
+    if os.path.exists(pathToTraces / textName):
+        sourcesTime=os.path.getmtime(pathToTraces / textName)
+        with open(pathToTraces / textName, "rt") as ftext:
+            for line in ftext:
+                if line.strip():
+                    try:
+                        records.append(bytes(int(value) for value in line.split()))
+                    except ValueError:
+                        print("[!] \"%s\" holds a value which is not a byte at line %d, the texts are not packed" % (textName, len(records)+1))
+                        return
+    else:
+        sourcesTime=0
+        while os.path.exists(pathToTraces / (fileFormat % len(records))):
+            sourcesTime=max(sourcesTime, os.path.getmtime(pathToTraces / (fileFormat % len(records))))
+            with open(pathToTraces / (fileFormat % len(records)), "rb") as ftext:
+                records.append(ftext.read())
+    if not records or any(len(record) != TEXT_SIZE for record in records):
+        return
+    packedName=pathToTraces / name
+    with open(unfinishedName(packedName), "wb") as fpacked:
+        fpacked.write(b"".join(records))
+    os.replace(unfinishedName(packedName), packedName)
+    recordArtifact(pathToTraces, name, "texts", T=len(records), sourcesTime=sourcesTime)
+
+
+#Maps the packed texts file name of pathToTraces as a T x TEXT_SIZE uint8
+#array, or returns None if it is missing or not up to date.
+def mapPackedTexts(pathToTraces, name):
+    if not packedTextsUpToDate(pathToTraces, name):
+        return None
+    size=os.path.getsize(pathToTraces / name)
+    if not size or size % TEXT_SIZE:
+        return None
+    return np.memmap(pathToTraces / name, dtype=np.uint8, mode='r', shape=(size//TEXT_SIZE, TEXT_SIZE))
+
+
+#Reads the header of the nodeVectors.bin file fileName (v1 or v2) and returns
+#(version, numOfNodes, T, rowStride, dataOffset, indexOffset, indexSize)
+def readNodeVectorsHeader(fileName):
+    with open(fileName, "rb") as ftrace:
+        header=ftrace.read(HEADER_V2_SIZE)
+    if header[:8] == TRACE_HEADER:
+        numOfNodes=int.from_bytes(header[8:12], byteorder='big')
+        T=int.from_bytes(header[12:16], byteorder='big')
+        return (1, numOfNodes, T, rowStride(T, 1), 16, 0, 0)
+    assert header[:8] == TRACE_HEADER_V2 and len(header) == HEADER_V2_SIZE
+    version=int.from_bytes(header[8:12], byteorder='big')
+    assert version == 2, "Unsupported nodeVectors.bin version %d" % version
+    fields=[(12, 16), (16, 20), (20, 24), (24, 32), (32, 40), (40, 48)]
+    return (version,)+tuple(int.from_bytes(header[a:b], byteorder='big') for a, b in fields)
+
+
+#Returns the number of nodes and the number of traces of all the segments
 def getHeader(pathToTraces):
     #OPENING THE FILE
     try:
-        with open(pathToTraces / "nodeVectors.bin", "rb") as ftrace:
-            header=ftrace.read(16)
-        assert header[:8] == TRACE_HEADER
-        ftrace.close()
+        files=nodeVectorsFiles(pathToTraces)
+        (version, numOfNodes, T, *_)=readNodeVectorsHeader(files[0])
+        for segment in files[1:]:
+            (_, segmentNodes, segmentT, *_)=readNodeVectorsHeader(segment)
+            assert segmentNodes == numOfNodes
+            T+=segmentT
     except IOError as err:
         print("Impossible to open the file \"NodeVectors.bin\"")
         print("Please execute first \"sage prepareTraces.sage ./yourPath/toTraces/\"")
@@ -185,16 +806,482 @@ def getHeader(pathToTraces):
         print("Exiting the program.")
         sys.exit()
 
-    #READING THE HEADER
-    numOfNodes=int.from_bytes(header[8:12], byteorder='big')
-    T=int.from_bytes(header[12:16], byteorder='big')
-
     return(numOfNodes, T)
 
 
-#Function openning nodeVectors.bin and returning a list of selction vectors
-def getNodeVectors(pathToTraces, requiredT, begining=0, ending=0, NonRedundantNodes=None, silent=0, mode='vect'):
+#Maps nodeVectors.bin and its segments in memory and returns the list of
+#their node vectors, as (numOfNodes x rowStride read-only uint8 array, T)
+#pairs, without reading them from the disk.
+def mapNodeVectors(pathToTraces):
+    getHeader(pathToTraces)
+    segments=[]
+    for fileName in nodeVectorsFiles(pathToTraces):
+        (version, numOfNodes, T, stride, dataOffset, indexOffset, indexSize)=readNodeVectorsHeader(fileName)
+        try:
+            with open(fileName, "rb") as ftrace:
+                ftrace.seek(-len(TRACE_FOOTER), os.SEEK_END)
+                assert ftrace.read() == TRACE_FOOTER
+        except IOError as err:
+            print("Impossible to open the file \"%s\"" % fileName.name)
+            print("Please execute first \"sage prepareTraces.sage ./yourPath/toTraces/\"")
+            print(err)
+            print("Exiting the program.")
+            sys.exit()
+        dataEnd=dataOffset + numOfNodes*stride
+        assert not indexSize or indexOffset == dataEnd
+        assert os.path.getsize(fileName) == dataEnd + indexSize + len(TRACE_FOOTER)
+        segments.append((np.memmap(fileName, dtype=np.uint8, mode='r', offset=dataOffset, shape=(numOfNodes, stride)), T))
+    return segments
+
+
+#Returns the index section of a v2 nodeVectors.bin as a dictionary of named
+#node lists (e.g. the non redundant nodes found by RNR), empty for v1 files.
+def readNodeVectorsIndex(pathToTraces):
+    (version, numOfNodes, T, stride, dataOffset, indexOffset, indexSize)=readNodeVectorsHeader(pathToTraces / "nodeVectors.bin")
+    index={}
+    if not indexSize:
+        return index
+    with open(pathToTraces / "nodeVectors.bin", "rb") as ftrace:
+        ftrace.seek(indexOffset)
+        section=ftrace.read(indexSize)
+    pos=0
+    while pos < len(section):
+        name=section[pos:pos+INDEX_NAME_SIZE].rstrip(b"\0").decode()
+        count=int.from_bytes(section[pos+INDEX_NAME_SIZE:pos+INDEX_NAME_SIZE+8], byteorder='big')
+        pos+=INDEX_NAME_SIZE+8
+        index[name]=np.frombuffer(section, dtype='>u4', count=count, offset=pos).astype(np.int64).tolist()
+        pos+=4*count
+    return index
+
+
+#Stores the node list nodes under name in the index section of a v2
+#nodeVectors.bin, replacing the list of the same name if any.
+#Returns False (and does nothing) for v1 files, which have no index section.
+def addNodeVectorsIndex(pathToTraces, name, nodes):
+    fileName=pathToTraces / "nodeVectors.bin"
+    (version, numOfNodes, T, stride, dataOffset, indexOffset, indexSize)=readNodeVectorsHeader(fileName)
+    if version < 2:
+        return False
+    assert len(name.encode()) <= INDEX_NAME_SIZE
+    index=readNodeVectorsIndex(pathToTraces)
+    index[name]=nodes
+    section=b"".join(
+        key.encode().ljust(INDEX_NAME_SIZE, b"\0") + to_bytes(len(values), 8, 'big') + np.asarray(values, dtype='>u4').tobytes()
+        for key, values in index.items()
+    )
+    indexOffset=dataOffset + numOfNodes*stride
+    with open(fileName, "r+b") as ftrace:
+        ftrace.seek(indexOffset)
+        ftrace.write(section)
+        ftrace.write(TRACE_FOOTER)
+        ftrace.truncate()
+        ftrace.seek(0)
+        writeNodeVectorsHeader(ftrace, numOfNodes, T, version, indexOffset, len(section))
+    recordNodeVectors(pathToTraces)
+    return True
+
+
+#Copies the rows nodes (a range or a list of indexes) of one mapped segment,
+#truncated to their first requiredT bits, into a packed uint8 array.
+def gatherSegmentNodeVectors(nodeVectorsFile, nodes, requiredT):
+    requiredTbytes=(requiredT+7)//8
+    if isinstance(nodes, range) and nodes.step == 1:
+        rows=np.array(nodeVectorsFile[nodes.start:nodes.stop, :requiredTbytes])
+    else:
+        rows=nodeVectorsFile[np.asarray(nodes, dtype=np.int64), :requiredTbytes]
+    if requiredT % 8:
+        rows[:, -1] &= (0xFF << (8 - requiredT%8)) & 0xFF
+    return rows
+
+
+#Copies the rows nodes of the mapped segments, truncated to their first
+#requiredT bits, into a packed uint8 array. Only the segments holding the
+#first requiredT traces are read.
+def gatherNodeVectors(segments, nodes, requiredT):
+    parts=[]
+    offset=0
+    for nodeVectorsFile, T in segments:
+        if offset >= requiredT:
+            break
+        partT=min(T, requiredT-offset)
+        parts.append((gatherSegmentNodeVectors(nodeVectorsFile, nodes, partT), partT))
+        offset+=partT
+    if len(parts) == 1:
+        return parts[0][0]
+    if all(partT % 8 == 0 for _, partT in parts[:-1]):
+        return np.concatenate([rows for rows, _ in parts], axis=1)
+    bits=np.concatenate([np.unpackbits(rows, axis=1, count=partT) for rows, partT in parts], axis=1)
+    return np.packbits(bits, axis=1)
+
+
+#64-bit fingerprint of each row of the uint64 array words (FNV-style folding
+#of the words followed by a final mixing)
+def fingerprintRows(words):
+    h = np.full(len(words), 0xCBF29CE484222325, dtype=np.uint64)
+    for column in range(words.shape[1]):
+        h ^= words[:, column]
+        h *= np.uint64(FINGERPRINT_PRIME)
+    h ^= h >> np.uint64(29)
+    h *= np.uint64(0xBF58476D1CE4E5B9)
+    h ^= h >> np.uint64(32)
+    return h
+
+
+#Returns the rows of the PackedMatrix vectors complemented so that their first
+#bit is 0, with the mask of the rows that have been complemented
+def canonicalRows(vectors, ONES):
+    complemented = (vectors.bytes()[:, 0] >> 7).astype(bool)
+    return np.where(complemented[:, None], vectors.words ^ ONES.words, vectors.words), complemented
+
+
+#Fingerprints all the node vectors and maps the constant, duplicate and
+#complemented ones to the first node with the same vector up to complement
+#(the canonical one). The index {node: (canonical, complemented)}, canonical
+#being -1 for constant nodes, is saved into dedup.pkl. Fingerprint matches are
+#checked against the vectors themselves, so collisions only keep nodes.
+def buildDedupIndex(pathToTraces):
+    from PackedMatrix import PackedMatrix
+    (numOfNodes, T)=getHeader(pathToTraces)
+    segments=mapNodeVectors(pathToTraces)
+    ONES=PackedMatrix.fromBits(np.ones((1, T), dtype=np.uint8))
+    nodesPerBlock=max(1, DEDUP_BLOCK_BYTES // (8*ONES.words.shape[1]))
+
+    t0=time()
+    fingerprints={}
+    index={}
+    for nodeBegining in range(0, numOfNodes, nodesPerBlock):
+        nodes=range(nodeBegining, min(nodeBegining+nodesPerBlock, numOfNodes))
+        vectors=PackedMatrix.fromBytes(gatherNodeVectors(segments, nodes, T), T)
+        words, complemented=canonicalRows(vectors, ONES)
+        constant=~words.any(axis=1)
+        h=fingerprintRows(words)
+
+        candidates=[]
+        for i, node in enumerate(nodes):
+            if constant[i]:
+                index[node]=(-1, bool(complemented[i]))
+                continue
+            canonical=fingerprints.setdefault(int(h[i]), node)
+            if canonical != node:
+                candidates.append((i, node, canonical))
+
+        if candidates:
+            canonicals=PackedMatrix.fromBytes(gatherNodeVectors(segments, [canonical for _, _, canonical in candidates], T), T)
+            canonicalWords, canonicalComplemented=canonicalRows(canonicals, ONES)
+            for k, (i, node, canonical) in enumerate(candidates):
+                if (words[i] == canonicalWords[k]).all():
+                    index[node]=(canonical, bool(complemented[i] != canonicalComplemented[k]))
+        print("Deduplicating node vectors: node %d/%d, %d duplicates so far" % (nodes.stop, numOfNodes, len(index)), end="\r")
+    print()
+
+    with open(pathToTraces / DEDUP_FILE, "wb") as file:
+        pickle.dump({"T": T, "index": index}, file)
+    recordArtifact(pathToTraces, DEDUP_FILE, "dedup", T=T)
+    TOTALtime=time()-t0
+    print("The dedup index \"%s\" maps %d constant, duplicate or complemented nodes (%.2f%%) to canonical ones, built in %.2fs" % (DEDUP_FILE, len(index), 100*len(index)/numOfNodes, TOTALtime))
+    return index
+
+
+#Returns the dedup index of pathToTraces, or None if there is none or if it
+#was built for another number of traces
+def readDedupIndex(pathToTraces):
+    try:
+        with open(pathToTraces / DEDUP_FILE, "rb") as file:
+            dedup=pickle.load(file)
+    except IOError:
+        return None
+    (numOfNodes, T)=getHeader(pathToTraces)
+    if dedup["T"] != T:
+        print("The dedup index was built for T=%d traces instead of %d, it is ignored" % (dedup["T"], T))
+        return None
+    return dedup["index"]
+
+
+#Whether the dedup index entry of a node (None if it is not in the index)
+#makes it redundant: constants and duplicates are linearly redundant, while
+#complements and all-one constants are only affinely redundant
+def isDedupRedundant(entry, affine=True):
+    return entry is not None and (affine or not entry[1])
+
+
+#Whether the dedup index entry of a node makes it redundant among the nodes
+#of the set nodes (all of them with None): a duplicate or complement is only
+#redundant if the node it duplicates is one of them
+def isDedupRedundantAmong(entry, affine=True, nodes=None):
+    return isDedupRedundant(entry, affine) and (nodes is None or entry[0] == -1 or entry[0] in nodes)
+
+
+#Returns the list of the nodes (all of them, or the sorted list nodes) that
+#are not redundant according to the dedup index among these nodes, or None if
+#there is no dedup index
+def getDedupNodes(pathToTraces, affine=True, nodes=None):
+    index=readDedupIndex(pathToTraces)
+    if index is None:
+        return None
+    if nodes is None:
+        (numOfNodes, T)=getHeader(pathToTraces)
+        return [node for node in range(numOfNodes) if not isDedupRedundant(index.get(node), affine)]
+    nodeSet=set(nodes)
+    return [node for node in nodes if not isDedupRedundantAmong(index.get(node), affine, nodeSet)]
+
+
+#Returns the redundancy relations (lists of nodes XORing to a constant) of the
+#nodes removed by the dedup index (among the nodes of the set nodes, if
+#given), in the format of the RNR relations
+def getDedupRelations(pathToTraces, affine=True, nodes=None):
+    index=readDedupIndex(pathToTraces)
+    if index is None:
+        return []
+    relations=[]
+    for node, entry in sorted(index.items()):
+        if (nodes is None or node in nodes) and isDedupRedundantAmong(entry, affine, nodes):
+            relations.append([node] if entry[0] == -1 else [entry[0], node])
+    return relations
+
+
+#Records nodeVectors.bin in the manifest
+def recordNodeVectors(pathToTraces):
+    (version, numOfNodes, T, stride, dataOffset, indexOffset, indexSize)=readNodeVectorsHeader(pathToTraces / "nodeVectors.bin")
+    recordArtifact(pathToTraces, "nodeVectors.bin", "nodeVectors", version=version, numOfNodes=numOfNodes, T=T)
+
+
+#Fingerprint of the node vectors of nodeVectors.bin: a hash of its numbers of
+#nodes and traces and of its first FINGERPRINT_BYTES bytes of rows. It changes
+#when the traces are transposed again, but not when segments or the index are
+#added, so that the artifacts derived from the first traces stay valid.
+def nodeVectorsFingerprint(pathToTraces):
+    fileName=pathToTraces / "nodeVectors.bin"
+    if not os.path.exists(fileName):
+        return None
+    (version, numOfNodes, T, stride, dataOffset, indexOffset, indexSize)=readNodeVectorsHeader(fileName)
+    with open(fileName, "rb") as ftrace:
+        ftrace.seek(dataOffset)
+        rows=ftrace.read(min(numOfNodes*stride, FINGERPRINT_BYTES))
+    return hashlib.sha1(repr((numOfNodes, T)).encode() + rows).hexdigest()
+
+
+#Size in bytes of an artifact (a file, or a directory of files)
+def artifactSize(fileName):
+    if os.path.isdir(fileName):
+        return sum(entry.stat().st_size for entry in os.scandir(fileName) if entry.is_file())
+    return os.path.getsize(fileName)
+
+
+#Reads the manifest of pathToTraces, empty if there is none
+def readManifest(pathToTraces):
+    try:
+        with open(pathToTraces / MANIFEST_FILE, "rt") as fmanifest:
+            return json.load(fmanifest)
+    except (IOError, ValueError):
+        return {}
+
+
+#Records the artifact name of pathToTraces in the manifest, with its kind, its
+#parameters, its size and the fingerprint of the node vectors it derives from.
+#The manifest is locked while it is updated, as several runs (e.g. RNR with
+#different windows) may record their artifacts in the same folder.
+def recordArtifact(pathToTraces, name, kind, **parameters):
+    entry=dict(parameters, kind=kind, size=artifactSize(pathToTraces / name), source=nodeVectorsFingerprint(pathToTraces))
+    fileName=pathToTraces / MANIFEST_FILE
+    lockName=unfinishedName(fileName, ".lock")
+    while True:
+        with open(lockName, "a") as flock:
+            fcntl.flock(flock, fcntl.LOCK_EX)
+            #The lock file is removed by its holder after the update: the lock
+            #only holds if the file was not removed while it was awaited
+            try:
+                if os.stat(lockName).st_ino != os.fstat(flock.fileno()).st_ino:
+                    continue
+            except FileNotFoundError:
+                continue
+            manifest=readManifest(pathToTraces)
+            manifest[name]=entry
+            tmpName=unfinishedName(fileName, ".%d.tmp" % os.getpid())
+            with open(tmpName, "wt") as fmanifest:
+                json.dump(manifest, fmanifest, indent=1, sort_keys=True, default=int)
+            os.replace(tmpName, fileName)
+            os.remove(lockName)
+            return
+
+
+#Artifacts of the given kind recorded in the manifest, as name -> entry, for
+#the ones still up to date (same size, derived from the same node vectors).
+#The stale ones are reported and skipped. Returns None if no artifact of this
+#kind is recorded, e.g. for the traces prepared before the manifest.
+def findArtifacts(pathToTraces, kind):
+    entries={name: entry for name, entry in readManifest(pathToTraces).items() if entry["kind"] == kind}
+    if not entries:
+        return None
+    fingerprint=nodeVectorsFingerprint(pathToTraces)
+    upToDate={}
+    for name, entry in entries.items():
+        if not os.path.exists(pathToTraces / name):
+            continue
+        if entry["source"] == fingerprint and artifactSize(pathToTraces / name) == entry["size"]:
+            upToDate[name]=entry
+        else:
+            print("[!] \"%s\" is stale (the traces or the file changed since it was created), it is ignored" % name)
+    return upToDate
+
+
+#Key of the node vectors cache for the rows nodes truncated to requiredT bits.
+#The segments are identified by their inode, modification time and header,
+#so that entries of node vectors transposed again are never reused.
+def nodeVectorsCacheKey(pathToTraces, requiredT, nodes):
+    key=hashlib.sha1()
+    for fileName in nodeVectorsFiles(pathToTraces):
+        stat=os.stat(fileName)
+        key.update(repr((fileName.name, stat.st_dev, stat.st_ino, stat.st_mtime_ns, readNodeVectorsHeader(fileName)[:5])).encode())
+    key.update(repr(requiredT).encode())
+    if isinstance(nodes, range):
+        key.update(repr(nodes).encode())
+    else:
+        key.update(np.asarray(nodes, dtype=np.int64).tobytes())
+    return key.hexdigest()
+
+
+#Maps the cached packed matrix (node vectors or selection vectors) of the given
+#key as a nrows x nwords uint64 array and marks it as recently used, or returns
+#None if it is not cached.
+def readCachedMatrix(pathToTraces, key):
+    fileName=pathToTraces / CACHE_DIR / (key + ".npy")
+    try:
+        words=np.load(fileName, mmap_mode='r')
+    except (IOError, ValueError):
+        return None
+    os.utime(fileName)
+    return words
+
+
+#Saves the packed matrix words under the given key, then evicts the least
+#recently used entries until the cache fits in cacheBudget bytes.
+def writeCachedMatrix(pathToTraces, key, words, cacheBudget=CACHE_BUDGET):
+    if words.nbytes > cacheBudget:
+        return
+    cacheDir=pathToTraces / CACHE_DIR
+    cacheDir.mkdir(exist_ok=True)
+    fileName=cacheDir / (key + ".npy")
+    with open(unfinishedName(fileName), "wb") as fcache:
+        np.save(fcache, words)
+    os.replace(unfinishedName(fileName), fileName)
+    evictCachedMatrices(cacheDir, cacheBudget)
+
+
+#Evicts the least recently used entries of the cache cacheDir until it fits in
+#cacheBudget bytes
+def evictCachedMatrices(cacheDir, cacheBudget):
+    entries=sorted(cacheDir.glob("*.npy"), key=lambda entry: entry.stat().st_mtime)
+    size=sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if size <= cacheBudget:
+            break
+        size-=entry.stat().st_size
+        os.remove(entry)
+
+
+#Gathers the node vectors of nodes truncated to requiredT bits into the cache
+#entry key, WINDOW_PREFETCH rows at a time so that they are never all held in
+#memory, and maps it as readCachedMatrix does. Returns None if they do not fit
+#in cacheBudget bytes.
+def cacheNodeVectors(pathToTraces, segments, nodes, requiredT, key, cacheBudget=CACHE_BUDGET):
+    from PackedMatrix import PackedMatrix
+    shape=(len(nodes), (requiredT+63)//64)
+    if 8*shape[0]*shape[1] > cacheBudget:
+        return None
+    cacheDir=pathToTraces / CACHE_DIR
+    cacheDir.mkdir(exist_ok=True)
+    fileName=cacheDir / (key + ".npy")
+    words=np.lib.format.open_memmap(unfinishedName(fileName), mode='w+', dtype=np.uint64, shape=shape)
+    for first in range(0, len(nodes), WINDOW_PREFETCH):
+        block=nodes[first:first+WINDOW_PREFETCH]
+        words[first:first+len(block)]=PackedMatrix.fromBytes(gatherNodeVectors(segments, block, requiredT), requiredT).words
+    words.flush()
+    del words
+    os.replace(unfinishedName(fileName), fileName)
+    evictCachedMatrices(cacheDir, cacheBudget)
+    return readCachedMatrix(pathToTraces, key)
+
+
+#Node vectors of nodes (a range or a list of indexes) for the algorithms
+#sliding a window over them: only a block of rows covering the requested
+#ones, plus WINDOW_PREFETCH rows ahead, is gathered from the mapped segments
+#and converted into a Sage matrix at a time. The row i is the node vector of
+#nodes[i], as in the matrices returned by getNodeVectors. With words (the
+#mapped cache entry of these node vectors), the blocks are copied from it.
+class NodeVectorsWindow:
+    def __init__(self, segments, nodes, requiredT, window, words=None):
+        self.segments = segments
+        self.nodes = nodes
+        self.words = words
+        self.ncols = requiredT
+        self.span = window + WINDOW_PREFETCH
+        self.begining = 0
+        self.block = None
+        self.sageBlock = None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    #Makes sure that the rows first to last are in the current block
+    def load(self, first, last):
+        from PackedMatrix import PackedMatrix
+        if self.block is not None and self.begining <= first and last < self.begining + len(self.block):
+            return
+        self.block = self.sageBlock = None
+        ending = min(len(self.nodes), max(last+1, first+self.span))
+        if self.words is not None:
+            self.block = PackedMatrix(np.array(self.words[first:ending]), self.ncols)
+        else:
+            self.block = PackedMatrix.fromBytes(gatherNodeVectors(self.segments, self.nodes[first:ending], self.ncols), self.ncols)
+        self.begining = first
+
+    #Rows indexes as a PackedMatrix
+    def rows(self, indexes):
+        from PackedMatrix import PackedMatrix
+        indexes = np.asarray(indexes, dtype=np.int64)
+        if not len(indexes):
+            return PackedMatrix.zeros(0, self.ncols)
+        self.load(int(indexes.min()), int(indexes.max()))
+        return self.block.rows(indexes - self.begining)
+
+    #Indexes of the columns equal to value in the row i
+    def support(self, i, value=1):
+        self.load(i, i)
+        return self.block.support(i - self.begining, value)
+
+    #Filtered window of the rows indexes, see PackedMatrix.window
+    def window(self, indexes, columns, ones=False, affine=False, transposed=False):
+        from PackedMatrix import PackedMatrix
+        indexes = np.asarray(indexes, dtype=np.int64)
+        if not len(indexes):
+            return PackedMatrix.zeros(0, self.ncols).window(indexes, columns, ones, affine, transposed)
+        self.load(int(indexes.min()), int(indexes.max()))
+        return self.block.window(indexes - self.begining, columns, ones, affine, transposed)
+
+    #Rows indexes as a Sage matrix, sliced out of the Sage conversion of the
+    #current block
+    def __getitem__(self, indexes):
+        from sage.all import Matrix, GF
+        indexes = np.asarray(indexes, dtype=np.int64)
+        if not len(indexes):
+            return Matrix(GF(2), 0, self.ncols)
+        self.load(int(indexes.min()), int(indexes.max()))
+        if self.sageBlock is None:
+            self.sageBlock = self.block.toSage()
+        return self.sageBlock[(indexes - self.begining).tolist()]
+
+
+#Function openning nodeVectors.bin and returning a list of selction vectors.
+#With mode='packed', the node vectors are returned as a PackedMatrix.
+#With mode='window', they are returned as a NodeVectorsWindow loading only
+#the rows around a sliding window of window rows.
+#NonRedundantNodes may also be the name of a node list of the index section.
+#Node vectors gathered for a subset of the nodes (an NRN list), in every mode,
+#are kept in a cache of at most cacheBudget bytes, so that the next runs on the
+#same nodes and traces map them back directly (cacheBudget=0 disables it).
+def getNodeVectors(pathToTraces, requiredT, begining=0, ending=0, NonRedundantNodes=None, silent=0, mode='vect', cacheBudget=CACHE_BUDGET, window=0):
     from sage.all import Matrix, GF, vector
+    from PackedMatrix import PackedMatrix
     (numOfNodes, T)=getHeader(pathToTraces)
 
     #Opens only from the begining index to the ending one
@@ -219,95 +1306,75 @@ def getNodeVectors(pathToTraces, requiredT, begining=0, ending=0, NonRedundantNo
         print("Exiting the program.")
         sys.exit()
 
-    Tbytes=(T+7)//8
-    requiredTbytes=(requiredT)//8
-    assert requiredT <= T
-    assert requiredTbytes <= Tbytes
-
-    #OPENING THE FILE
-    try:
-        with open(pathToTraces / "nodeVectors.bin", "rb") as ftrace:
-            assert ftrace.read(16).startswith(TRACE_HEADER)
-            fileBytes=ftrace.read()
-        assert fileBytes.endswith(TRACE_FOOTER)
-        fileBytes = fileBytes[:-8]
-        assert len(fileBytes) == numOfNodes * Tbytes
-        ftrace.close()
-    except IOError as err:
-        print("Impossible to open the file \"NodeVectors.bin\"")
-        print("Please execute first \"sage prepareTraces.sage ./yourPath/toTraces/\"")
-        print(err)
-        print("Exiting the program.")
-        sys.exit()
+    #MAPPING THE FILE
+    segments=mapNodeVectors(pathToTraces)
+    if isinstance(NonRedundantNodes, str):
+        NonRedundantNodes=readNodeVectorsIndex(pathToTraces)[NonRedundantNodes]
 
     #If an NRN list is given, it opens only non redudant vectors
     nodesToGoThrough=[]
     if NonRedundantNodes is not None:
-        newBegining=0
-        while NonRedundantNodes[newBegining]<begining:
-            newBegining+=1
-        newBegining=max(newBegining-1,0)
-        newEnding=newBegining
-        while newEnding<len(NonRedundantNodes) and NonRedundantNodes[newEnding]<ending :
-            newEnding+=1
+        #Bounds found by binary search in the sorted NRN array
+        NonRedundantNodes=np.asarray(NonRedundantNodes, dtype=np.int64)
+        newBegining=max(int(np.searchsorted(NonRedundantNodes, begining))-1, 0)
+        newEnding=max(int(np.searchsorted(NonRedundantNodes, ending)), newBegining)
         nodesToGoThrough=NonRedundantNodes[newBegining:newEnding]
     else:
         nodesToGoThrough=range(begining,ending)
         newBegining=begining
         newEnding=ending
 
+    #Only the gathers of node subsets (e.g. the non redundant ones) are cached:
+    #a range of nodes is read straight from the segments
+    cached=cacheBudget and not isinstance(nodesToGoThrough, range)
+    key=nodeVectorsCacheKey(pathToTraces, requiredT, nodesToGoThrough) if cached else None
+
+    if mode=='window':
+        words=None
+        if key:
+            words=readCachedMatrix(pathToTraces, key)
+            if words is None:
+                words=cacheNodeVectors(pathToTraces, segments, nodesToGoThrough, requiredT, key, cacheBudget)
+        return (NodeVectorsWindow(segments, nodesToGoThrough, requiredT, window, words), nodesToGoThrough, newBegining, newEnding)
+
     #RECOVERING THE NODE VECTORS
     if not silent:
         print("Opening NodeVectors.bin")
-        SUMtime=0
 
     t0 = time()
-    NODEVECTORS=[]
-    for nodePos in range(len(nodesToGoThrough)):
-        node=nodesToGoThrough[nodePos]
-        if not silent:
-            t1=time()
-        nodeVector=[]
-        for nodeVecByte in fileBytes[node*Tbytes:node*Tbytes+requiredTbytes]:
-            for i in range(8):
-                nodeVector.append((nodeVecByte >> (7-i)) & 1)
-        if requiredT%8:
-            for i in range(requiredT%8):
-                nodeVector.append((fileBytes[node*Tbytes+requiredTbytes] >> (7-i)) & 1)
-        if mode=='vect':
-            # NODEVECTORS.append(vector(GF(2),nodeVector))
-            # NODEVECTORS.append(Matrix(GF(2), 1, requiredT, nodeVector))
-            NODEVECTORS.append(nodeVector)
-        elif mode=='mat':
-            NODEVECTORS.append(Matrix(GF(2), 1, requiredT, nodeVector))
-        if not silent:
-            t2=time()
-            SUMtime+=t2-t1
-            if node%128==0:
-                print("[.] node %d/%d (%.2f%%)," % (nodePos, len(nodesToGoThrough), 100*nodePos/len(nodesToGoThrough)), end="")
-                timeRemaining=SUMtime/(nodePos+1)*(len(nodesToGoThrough)-nodePos)
-                print(" Estimated remaining time: %dh%02dm%.2fs                         " % (timeRemaining//3600, (timeRemaining//60)%60, timeRemaining%60), end = "\r")
+    (nodeVectorsFile, firstT)=segments[0]
+    if isinstance(nodesToGoThrough, range) and requiredT == firstT and nodeVectorsFile.shape[1] == 8*((firstT+63)//64):
+        #Whole word-aligned rows (v2): used in place, without copy
+        NODEVECTORS=PackedMatrix(nodeVectorsFile[newBegining:newEnding].view(np.uint64), requiredT)
+    else:
+        words=readCachedMatrix(pathToTraces, key) if key else None
+        if words is not None:
+            NODEVECTORS=PackedMatrix(words, requiredT)
+        else:
+            NODEVECTORS=PackedMatrix.fromBytes(gatherNodeVectors(segments, nodesToGoThrough, requiredT), requiredT)
+            if key:
+                writeCachedMatrix(pathToTraces, key, NODEVECTORS.words, cacheBudget)
+    del segments, nodeVectorsFile
 
     if not silent:
-        print("                                                                                           ", end="")
-        print('\033[1A', end='\x1b[2K')
-
         TOTALtime = time() - t0
         print(
             f"\r[✓] Opened {len(nodesToGoThrough):d} nodes in"
             f" {int(TOTALtime)//3600:d}h{(int(TOTALtime)//60)%60:02d}m{TOTALtime%60:.2f}s"
         )
         print("[.] Converting the node vectors into a matrix")
-        t1=time()
-
-    if mode=='fulmat':
-        output=(Matrix(GF(2),NODEVECTORS).transpose(), nodesToGoThrough, newBegining, newEnding)
 
-    if mode=='mat':
+    if mode=='packed':
         output=(NODEVECTORS, nodesToGoThrough, newBegining, newEnding)
 
+    elif mode=='mat':
+        output=([Matrix(GF(2), 1, requiredT, nodeVector) for nodeVector in NODEVECTORS.bits()], nodesToGoThrough, newBegining, newEnding)
+
+    elif mode=='fulmat':
+        output=(NODEVECTORS.toSage().transpose(), nodesToGoThrough, newBegining, newEnding)
+
     else:
-        output=(Matrix(GF(2),NODEVECTORS), nodesToGoThrough, newBegining, newEnding)
+        output=(NODEVECTORS.toSage(), nodesToGoThrough, newBegining, newEnding)
 
     if not silent:
         TOTALtime = time() - t0
@@ -320,13 +1387,20 @@ def getNodeVectors(pathToTraces, requiredT, begining=0, ending=0, NonRedundantNo
     return(output)
 
 
-#@TODO
-def writeNodeVectors(vecs, file):
+#Writes the vectors vecs (a list of 0/1 sequences or a PackedMatrix) as the
+#node vectors of a new nodeVectors.bin file of the given version
+def writeNodeVectors(vecs, file, version=1):
+    if not isinstance(vecs, (list, tuple)):
+        with open(file, "wb") as f:
+            writeNodeVectorsHeader(f, vecs.nrows(), vecs.ncols, version)
+            f.write(vecs.bytes()[:, :rowStride(vecs.ncols, version)].tobytes())
+            f.write(TRACE_FOOTER)
+        return
+
     with open(file, "wb") as f:
-        f.write(TRACE_HEADER)
-        f.write(to_bytes(len(vecs), 4, 'big'))
-        f.write(to_bytes(len(vecs[0]), 4, 'big'))
         T = len(vecs[0])
+        writeNodeVectorsHeader(f, len(vecs), T, version)
+        padding = bytes(rowStride(T, version)-(T+7)//8)
 
         for vec in vecs:
             assert len(vec) == T
@@ -340,6 +1414,7 @@ def writeNodeVectors(vecs, file):
             if T % 8:
                 f.write(to_bytes(nodeByte, 1, 'big'))
                 nodeByte = 0
+            f.write(padding)
 
         f.write(TRACE_FOOTER)
 
@@ -356,6 +1431,26 @@ if __name__ == "__main__":
         help="path to directory with trace/plaintext/ciphertext files"
     )
 
+    parser.add_argument(
+        '-m', '--memory', type=int, default=None,
+        help="Stream the traces by tiles using about this much memory (in MB) instead of loading them all"
+    )
+
+    parser.add_argument(
+        '--format', type=int, default=1, choices=(1, 2),
+        help="Version of nodeVectors.bin: 2 has 64-bit aligned rows and an index section"
+    )
+
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help="Number of processes transposing the node vectors in parallel"
+    )
+
+    parser.add_argument(
+        '--dedup', action='store_true',
+        help="Build an index of the constant, duplicate and complemented node vectors, skipped by RNR"
+    )
+
     args = parser.parse_args()
 
-    transposeTraces(args.trace_dir)
+    transposeTraces(args.trace_dir, memoryLimit=args.memory, version=args.format, jobs=args.jobs, dedup=args.dedup)